@@ -0,0 +1,136 @@
+import csv
+import os
+import sys
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+import curriculum
+from db import get_db
+
+# Class-wide progress, kept up to date by triggers on lesson_read and
+# user_progress, so a dashboard never has to look at individual students.
+# unit_lesson_summary counts students by how many of a unit's lessons they
+# have read (students who read none have no row); unit_practice_summary
+# counts students who passed each unit's practice. Lesson reads show up once
+# the write-behind buffer is flushed. The tables and triggers are defined
+# once, between these markers in schema.sql.
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
+SUMMARY_BEGIN = "-- BEGIN class progress summary"
+SUMMARY_END = "-- END class progress summary"
+
+REBUILD_SUMMARY = """
+DELETE FROM unit_lesson_summary;
+INSERT INTO unit_lesson_summary (unit, lessons_read, students)
+SELECT unit, lessons_read, COUNT(*)
+FROM (SELECT unit, COUNT(*) AS lessons_read FROM lesson_read GROUP BY user_id, unit) AS per_student
+GROUP BY unit, lessons_read;
+
+DELETE FROM unit_practice_summary;
+INSERT INTO unit_practice_summary (unit, students)
+SELECT unit, COUNT(*) FROM user_progress WHERE practice_completed != 0 GROUP BY unit;
+"""
+
+SUMMARY_QUERY = """
+SELECT unit, lessons_read, students, 0 AS practice_completed
+FROM unit_lesson_summary WHERE students > 0
+UNION ALL
+SELECT unit, NULL, 0, students FROM unit_practice_summary
+"""
+
+EXPORT_COLUMNS = (
+    "unit",
+    "title",
+    "lessons_total",
+    "students",
+    "started",
+    "finished_lessons",
+    "lesson_reads",
+    "practice_completed",
+)
+
+
+def summary_schema():
+    """The summary tables and their triggers, as schema.sql defines them."""
+    with open(SCHEMA_PATH, encoding="utf-8") as f:
+        schema = f.read()
+    start = schema.index(SUMMARY_BEGIN)
+    return schema[start:schema.index(SUMMARY_END, start)]
+
+
+def rebuild_summary(db):
+    """Recount the summary tables from lesson_read and user_progress."""
+    db.commit()
+    db.executescript("BEGIN;" + REBUILD_SUMMARY + "COMMIT;")
+
+
+def class_summary():
+    """Per-unit completion across every student, in curriculum order.
+
+    "started" students have read at least one of the unit's lessons and
+    "finished_lessons" ones have read them all.
+    """
+    db = get_db()
+    units = {
+        unit["unit"]: {
+            "unit": unit["unit"],
+            "title": unit["title"],
+            "lessons_total": len(unit["lessons"]),
+            "started": 0,
+            "finished_lessons": 0,
+            "lesson_reads": 0,
+            "practice_completed": 0,
+        }
+        for unit in curriculum.current().units
+    }
+    for row in db.execute(SUMMARY_QUERY):
+        unit = units.get(row["unit"])
+        if unit is None:
+            continue
+        if row["lessons_read"] is None:
+            unit["practice_completed"] += row["practice_completed"]
+            continue
+        unit["started"] += row["students"]
+        unit["lesson_reads"] += row["lessons_read"] * row["students"]
+        if row["lessons_read"] >= unit["lessons_total"]:
+            unit["finished_lessons"] += row["students"]
+
+    students = db.execute('SELECT COUNT(*) FROM "user"').fetchone()[0]
+    for unit in units.values():
+        unit["students"] = students
+    return list(units.values())
+
+
+def is_teacher(user):
+    emails = current_app.config["TEACHER_EMAILS"]
+    return bool(getattr(user, "is_authenticated", False)) and (user.email or "").lower() in emails
+
+
+@click.command("export-progress")
+@click.option("--output", type=click.Path(dir_okay=False, writable=True), help="CSV file to write (default stdout).")
+@click.option("--rebuild", is_flag=True, help="Recount the summary tables from the raw progress first.")
+@with_appcontext
+def export_progress_command(output, rebuild):
+    """Export class-wide progress per unit as CSV."""
+    if rebuild:
+        rebuild_summary(get_db())
+    rows = class_summary()
+    f = open(output, "w", newline="", encoding="utf-8") if output else sys.stdout
+    try:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if output:
+            f.close()
+
+
+def init_app(app):
+    """Register export-progress and read TEACHER_EMAILS (comma-separated) for the teacher view."""
+    app.config.setdefault("TEACHER_EMAILS", os.getenv("TEACHER_EMAILS", ""))
+    emails = app.config["TEACHER_EMAILS"]
+    if isinstance(emails, str):
+        emails = emails.split(",")
+    app.config["TEACHER_EMAILS"] = {email.strip().lower() for email in emails if email.strip()}
+    app.cli.add_command(export_progress_command)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import submission_cache
+
+BASE_DIR = os.path.dirname(__file__)
+ANSWER_PATH = os.path.join(BASE_DIR, "data", "unit_answers.json")
+
+# How often (at most) to stat the answer key file for changes.
+ANSWER_KEY_CHECK_SECONDS = float(os.getenv("ANSWER_KEY_CHECK_SECONDS", "1"))
+
+# Default CPU budget for one test case; units can override it with
+# "case_cpu_seconds".
+CASE_CPU_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidAnswerKey(ValueError):
+    pass
+
+
+def compile_unit(unit_name, unit_data):
+    """Check a unit's entry and return the compact key the sandbox grades with.
+
+    Units without "test_cases" are a single case with no inputs, checked
+    against the unit's "answers".
+    """
+    if not isinstance(unit_data, dict):
+        raise InvalidAnswerKey(f"{unit_name}: expected an object")
+    cases = unit_data.get("test_cases")
+    if not cases:
+        if not isinstance(unit_data.get("answers"), list):
+            raise InvalidAnswerKey(f"{unit_name}: needs an \"answers\" list or \"test_cases\"")
+        cases = [{"answers": unit_data["answers"]}]
+    compact = []
+    for number, case in enumerate(cases, start=1):
+        if not isinstance(case, dict) or not isinstance(case.get("answers"), list):
+            raise InvalidAnswerKey(f"{unit_name}: test case {number} needs an \"answers\" list")
+        inputs = case.get("inputs") or {}
+        if not isinstance(inputs, dict):
+            raise InvalidAnswerKey(f"{unit_name}: test case {number} inputs must be an object")
+        compact.append({"inputs": inputs, "answers": case["answers"]})
+    points = unit_data.get("points")
+    if not isinstance(points, (int, float)) or isinstance(points, bool):
+        raise InvalidAnswerKey(f"{unit_name}: \"points\" must be a number")
+    return {
+        "cases": compact,
+        "points": points,
+        "stop_on_first_failure": bool(unit_data.get("stop_on_first_failure", True)),
+        "case_cpu_seconds": float(unit_data.get("case_cpu_seconds", CASE_CPU_SECONDS)),
+    }
+
+
+class AnswerKeys:
+    """One parsed, validated version of the answer key file."""
+
+    def __init__(self, raw):
+        self.version = hashlib.sha256(raw).hexdigest()
+        self.units = json.loads(raw)
+        if not isinstance(self.units, dict):
+            raise InvalidAnswerKey("answer key must be an object of units")
+        self.grading_keys = {name: compile_unit(name, data) for name, data in self.units.items()}
+
+    def unit(self, unit_name):
+        return self.units.get(unit_name)
+
+    def grading_key(self, unit_name):
+        return self.grading_keys.get(unit_name)
+
+
+class AnswerKeyStore:
+    """The current AnswerKeys for a file, reloaded when the file changes.
+
+    Callers should take one snapshot with current() and use it for the whole
+    operation, so the key they grade with and the version they record always
+    match. A file that fails to parse or validate is logged and the previous
+    version stays in use.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._current = None
+        self._stamp = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        now = time.monotonic()
+        if self._current is not None and now - self._checked_at < ANSWER_KEY_CHECK_SECONDS:
+            return self._current
+        with self._lock:
+            self._checked_at = now
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if stamp != self._stamp:
+                with open(self.path, "rb") as f:
+                    raw = f.read()
+                previous = self._current
+                try:
+                    self._current = AnswerKeys(raw)
+                except (ValueError, TypeError) as exc:
+                    if self._current is None:
+                        raise
+                    logger.error("Keeping answer key %s: %s", self._current.version[:12], exc)
+                if previous is not None and previous.version != self._current.version:
+                    # Results graded against the old key can't be served any more
+                    submission_cache.drop_version(previous.version)
+                self._stamp = stamp
+            return self._current
+
+
+STORE = AnswerKeyStore(ANSWER_PATH)
+
+
+def current():
+    return STORE.current()
+
+
+def version():
+    return STORE.current().version
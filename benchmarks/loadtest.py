@@ -0,0 +1,313 @@
+"""Drive a classroom-sized burst of traffic at the app and report latencies.
+
+Boots create_app() against a throwaway SQLite database, serves it on a local
+port and has N simulated students (already logged in, unit 1 finished) read
+articles, load the practice page and submit correct, incorrect and
+never-ending code, all at once.
+
+    python benchmarks/loadtest.py --students 30 --duration 30 --output before.json
+    python benchmarks/loadtest.py --students 30 --duration 30 --compare before.json
+
+Prints throughput, p50/p95/p99 latency per kind of request and how busy the
+sandbox pool was; --output saves the same numbers as JSON.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+DEFAULT_MIX = "article=50,practice=20,correct=15,incorrect=10,loop=5"
+ARTICLES = ["/articles/1/1a", "/articles/1/1b", "/articles/1/1c",
+            "/articles/2/2a", "/articles/2/2b", "/articles/2/2c"]
+CODE = {
+    "correct": "submit_answers(15 + 27, 100 / 4, 42 * 2)",
+    "incorrect": "submit_answers(15 + 27, 100 / 4, 42)",
+    "loop": "while True:\n    pass",
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("article", "practice") and name not in CODE:
+            raise SystemExit(f"unknown request kind in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest-rank
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def seed_database(path, students):
+    db = sqlite3.connect(path)
+    with open(os.path.join(BASE_DIR, "schema.sql"), encoding="utf-8") as f:
+        db.executescript(f.read())
+    now = time.time()
+    for n in range(students):
+        user_id = f"loadtest-{n}"
+        db.execute(
+            "INSERT INTO user (id, name, email, profile_pic) VALUES (?, ?, ?, ?)",
+            (user_id, f"Student {n}", f"student{n}@loadtest.invalid", "static/images/logo.png"),
+        )
+        db.executemany(
+            "INSERT INTO lesson_read (user_id, unit, slug, read_at) VALUES (?, 1, ?, ?)",
+            [(user_id, slug, now) for slug in ("1a", "1b", "1c")],
+        )
+        db.execute(
+            "INSERT INTO user_progress (user_id, unit, practice_completed) VALUES (?, 1, 1)",
+            (user_id,),
+        )
+    db.commit()
+    db.close()
+
+
+def boot(args, workdir):
+    # These are read at import time
+    if args.pool_size is not None:
+        os.environ["SANDBOX_POOL_SIZE"] = str(args.pool_size)
+    os.environ.setdefault("BYTEQUEST_RUN_DIR", os.path.join(workdir, "run"))
+    os.environ.setdefault("SUBMISSION_CACHE_DIR", os.path.join(workdir, "submission_cache"))
+
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    database = os.path.join(workdir, "loadtest.sqlite")
+    seed_database(database, args.students)
+    app = app_module.create_app({
+        "DATABASE": database,
+        "TESTING": True,
+        "ASYNC_SUBMISSIONS": args.async_submissions,
+    })
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return app, server
+
+
+def session_cookies(app, students):
+    """A logged-in Flask session cookie for each seeded student."""
+    cookies = []
+    for n in range(students):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = f"loadtest-{n}"
+            session["_fresh"] = True
+        cookies.append(client.get_cookie(app.config["SESSION_COOKIE_NAME"]).value)
+    return cookies
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.busy = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def add(self, kind, seconds, status, busy=False, error=False):
+        with self.lock:
+            self.latencies[kind].append(seconds)
+            self.statuses[kind][str(status)] += 1
+            self.busy[kind] += int(busy)
+            self.errors[kind] += int(error)
+
+
+def student(base_url, cookie, args, mix, deadline, budget, recorder, seed):
+    import requests
+    from codeEvaluator import BUSY_ERROR
+
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    http = requests.Session()
+    http.cookies.set("session", cookie)
+    counter = 0
+
+    while time.monotonic() < deadline and budget.acquire(blocking=False):
+        kind = rng.choices(kinds, weights)[0]
+        started = time.perf_counter()
+        busy = False
+        try:
+            if kind == "article":
+                response = http.get(base_url + rng.choice(ARTICLES))
+            elif kind == "practice":
+                response = http.get(base_url + "/practice/unit1")
+            else:
+                code = CODE[kind]
+                if not args.repeat_code:
+                    # A distinct AST each time so the submission cache can't answer it
+                    counter += 1
+                    code += f"\nloadtest_{seed}_{counter} = {counter}"
+                headers = {"Accept": "application/json"} if args.async_submissions else {}
+                response = http.post(
+                    base_url + "/submit_code",
+                    data={"unit_name": "unit1", "code": code},
+                    headers=headers,
+                )
+                if args.async_submissions and response.status_code == 202:
+                    status_url = base_url + response.json()["status_url"]
+                    while True:
+                        response = http.get(status_url, params={"wait": 25}, headers=headers)
+                        if response.status_code != 202:
+                            break
+                busy = BUSY_ERROR in response.text
+            elapsed = time.perf_counter() - started
+            recorder.add(kind, elapsed, response.status_code, busy=busy,
+                         error=response.status_code >= 400)
+        except requests.RequestException:
+            recorder.add(kind, time.perf_counter() - started, "exception", error=True)
+
+
+def summarise(recorder, elapsed, pool_before, pool_after, args):
+    routes = {}
+    total = 0
+    for kind, values in sorted(recorder.latencies.items()):
+        values.sort()
+        total += len(values)
+        routes[kind] = {
+            "count": len(values),
+            "errors": recorder.errors[kind],
+            "busy": recorder.busy[kind],
+            "statuses": dict(recorder.statuses[kind]),
+            "mean_ms": 1000 * sum(values) / len(values),
+            "p50_ms": 1000 * percentile(values, 50),
+            "p95_ms": 1000 * percentile(values, 95),
+            "p99_ms": 1000 * percentile(values, 99),
+            "max_ms": 1000 * values[-1],
+        }
+
+    sandbox = None
+    if pool_after is not None:
+        before = pool_before or {}
+        delta = {
+            name: pool_after[name] - before.get(name, 0)
+            for name in ("jobs", "busy_rejections", "recycled", "busy_seconds", "wait_seconds")
+        }
+        sandbox = dict(
+            delta,
+            size=pool_after["size"],
+            utilisation=delta["busy_seconds"] / (pool_after["size"] * elapsed) if elapsed else 0.0,
+            mean_wait_ms=1000 * delta["wait_seconds"] / delta["jobs"] if delta["jobs"] else 0.0,
+        )
+
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "students": args.students,
+            "duration": args.duration,
+            "requests": args.requests,
+            "mix": args.mix,
+            "async_submissions": args.async_submissions,
+            "repeat_code": args.repeat_code,
+            "pool_size": pool_after["size"] if pool_after else args.pool_size,
+        },
+        "elapsed_seconds": elapsed,
+        "requests": total,
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+        "routes": routes,
+        "sandbox": sandbox,
+    }
+
+
+def report(summary, previous=None):
+    def delta(new, old):
+        if old is None or new is None:
+            return ""
+        return f" ({new - old:+.1f})"
+
+    prev_routes = (previous or {}).get("routes", {})
+    print(f"{summary['requests']} requests in {summary['elapsed_seconds']:.1f}s, "
+          f"{summary['throughput_rps']:.1f} req/s"
+          + (delta(summary["throughput_rps"], previous.get("throughput_rps")) if previous else ""))
+    print(f"{'route':<10} {'count':>6} {'err':>4} {'busy':>4} {'p50 ms':>10} {'p95 ms':>14} {'p99 ms':>14}")
+    for kind, stats in summary["routes"].items():
+        old = prev_routes.get(kind, {})
+        print(f"{kind:<10} {stats['count']:>6} {stats['errors']:>4} {stats['busy']:>4} "
+              f"{stats['p50_ms']:>10.1f} "
+              f"{stats['p95_ms']:>8.1f}{delta(stats['p95_ms'], old.get('p95_ms')):<8} "
+              f"{stats['p99_ms']:>8.1f}{delta(stats['p99_ms'], old.get('p99_ms')):<8}")
+    sandbox = summary["sandbox"]
+    if sandbox:
+        print(f"sandbox: {sandbox['jobs']} jobs on {sandbox['size']} workers, "
+              f"{100 * sandbox['utilisation']:.0f}% busy, mean queue wait {sandbox['mean_wait_ms']:.1f} ms, "
+              f"{sandbox['busy_rejections']} turned away, {sandbox['recycled']} recycled")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--students", type=int, default=20, help="concurrent simulated students")
+    parser.add_argument("--duration", type=float, default=20, help="seconds to run for")
+    parser.add_argument("--requests", type=int, default=None, help="stop after this many requests")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"request kinds and weights (default {DEFAULT_MIX})")
+    parser.add_argument("--pool-size", type=int, default=None, help="SANDBOX_POOL_SIZE for the run")
+    parser.add_argument("--async", dest="async_submissions", action="store_true",
+                        help="grade on the background queue and long-poll for results")
+    parser.add_argument("--repeat-code", action="store_true",
+                        help="submit identical code each time, so the submission cache answers")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    parser.add_argument("--compare", help="a previous --output file to compare against")
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp(prefix="bytequest-loadtest-")
+    app, server = boot(args, workdir)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    cookies = session_cookies(app, args.students)
+
+    import codeEvaluator
+    pool = codeEvaluator.get_pool() if codeEvaluator.SANDBOX_POOL_SIZE > 0 else None
+    if pool is not None:
+        pool.warm()
+    pool_before = pool.stats() if pool else None
+
+    recorder = Recorder()
+    budget = threading.BoundedSemaphore(args.requests) if args.requests else threading.Semaphore(10 ** 9)
+    started = time.monotonic()
+    deadline = started + args.duration
+    threads = [
+        threading.Thread(
+            target=student,
+            args=(base_url, cookies[n], args, mix, deadline, budget, recorder, args.seed * 1000 + n),
+        )
+        for n in range(args.students)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    pool_after = pool.stats() if pool else None
+    server.shutdown()
+
+    summary = summarise(recorder, elapsed, pool_before, pool_after, args)
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+    report(summary, previous)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,148 @@
+"""Measure how long a fresh worker takes to start and serve its first page.
+
+Each run is a new Python process that imports app (which builds the app, the
+way a uWSGI worker does) and then renders an article for a logged-in student.
+The first run starts from an empty run directory and template cache, like the
+first worker after a deploy; the rest are like worker respawns.
+
+    python benchmarks/startup.py --runs 10 --output before.json
+    python benchmarks/startup.py --runs 10 --compare before.json
+
+Prints the median import and first-request times for the cold and warm runs,
+and which of the heavy optional modules ended up imported.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+HEAVY_MODULES = ("msal", "requests", "oauthlib", "RestrictedPython", "flask_wtf", "sqlalchemy", "PIL")
+FIRST_PAGE = "/articles/1/1a"
+
+
+def child():
+    """Runs inside the measured process; prints one JSON line."""
+    started = time.perf_counter()
+    import app as app_module
+    imported = time.perf_counter()
+
+    app = app_module.application
+    app.config["TESTING"] = True
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = "loadtest-0"
+        session["_fresh"] = True
+    response = client.get(FIRST_PAGE)
+    served = time.perf_counter()
+
+    print(json.dumps({
+        "import_seconds": imported - started,
+        "first_request_seconds": served - imported,
+        "status": response.status_code,
+        "modules": len(sys.modules),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def run_child(env):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child"],
+        env=env,
+        cwd=BASE_DIR,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def summarise(runs):
+    def median(key):
+        return 1000 * statistics.median(run[key] for run in runs)
+
+    return {
+        "runs": len(runs),
+        "import_ms": median("import_seconds"),
+        "first_request_ms": median("first_request_seconds"),
+        "total_ms": 1000 * statistics.median(
+            run["import_seconds"] + run["first_request_seconds"] for run in runs
+        ),
+        "statuses": sorted({run["status"] for run in runs}),
+        "modules": runs[-1]["modules"],
+        "heavy_modules": runs[-1]["heavy_modules"],
+    }
+
+
+def report(summary, previous=None):
+    def delta(phase, key):
+        if not previous or phase not in previous:
+            return ""
+        return f" ({summary[phase][key] - previous[phase][key]:+.1f})"
+
+    for phase in ("cold", "warm"):
+        stats = summary[phase]
+        print(f"{phase}: import {stats['import_ms']:.1f} ms{delta(phase, 'import_ms')}, "
+              f"first request {stats['first_request_ms']:.1f} ms{delta(phase, 'first_request_ms')}, "
+              f"total {stats['total_ms']:.1f} ms{delta(phase, 'total_ms')} "
+              f"(median of {stats['runs']}, status {stats['statuses']})")
+    warm = summary["warm"]
+    print(f"{warm['modules']} modules loaded; heavy: {', '.join(warm['heavy_modules']) or 'none'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="warm starts to measure after the cold one")
+    parser.add_argument("--no-bytecode-cache", action="store_true",
+                        help="turn the Jinja bytecode cache off")
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    parser.add_argument("--compare", help="a previous --output file to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child()
+        return 0
+
+    from loadtest import seed_database
+
+    workdir = tempfile.mkdtemp(prefix="bytequest-startup-")
+    try:
+        database = os.path.join(workdir, "startup.sqlite")
+        seed_database(database, 1)
+        env = dict(
+            os.environ,
+            BYTEQUEST_DATABASE=database,
+            BYTEQUEST_RUN_DIR=os.path.join(workdir, "run"),
+            SUBMISSION_CACHE_DIR="",
+            JINJA_BYTECODE_CACHE_DIR="" if args.no_bytecode_cache else os.path.join(workdir, "jinja_cache"),
+        )
+        cold = [run_child(env)]
+        warm = [run_child(env) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "bytecode_cache": not args.no_bytecode_cache,
+        "cold": summarise(cold),
+        "warm": summarise(warm),
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+    report(summary, previous)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,42 +1,361 @@
 import json
 import os
+import queue
+import select
 import subprocess
 import sys
+import threading
+import time
+
+import answer_keys
+import metrics
+import node_sync
+import sandbox_runner
+import submission_cache
 
 BASE_DIR = os.path.dirname(__file__)
-ANSWER_PATH = os.path.join(BASE_DIR, "data", "unit_answers.json")
 RUNNER_PATH = os.path.join(BASE_DIR, "sandbox_runner.py")
 EXEC_TIMEOUT_SECONDS = 3
 
+# Sandbox worker pool. Every web worker process gets its own pool of
+# long-lived `sandbox_runner.py --worker` processes so a submission doesn't pay
+# interpreter startup and the RestrictedPython import each time.
+SANDBOX_POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", "2"))
+# Workers are replaced after this many jobs (and after any limit violation).
+SANDBOX_MAX_JOBS_PER_WORKER = int(os.getenv("SANDBOX_MAX_JOBS_PER_WORKER", "100"))
+# How many submissions may wait for a free worker before we answer "busy".
+SANDBOX_QUEUE_DEPTH = int(os.getenv("SANDBOX_QUEUE_DEPTH", "8"))
+SANDBOX_QUEUE_TIMEOUT_SECONDS = float(os.getenv("SANDBOX_QUEUE_TIMEOUT_SECONDS", "10"))
+# Time allowed for a fresh worker to import everything and report ready.
+SANDBOX_STARTUP_TIMEOUT_SECONDS = float(os.getenv("SANDBOX_STARTUP_TIMEOUT_SECONDS", "10"))
+
+# Node-wide limits, shared by every web worker process on the machine: at most
+# SANDBOX_NODE_CONCURRENCY sandbox runs at once (0 turns the limit off) and at
+# most SANDBOX_NODE_QUEUE_DEPTH more waiting for one, each for up to
+# SANDBOX_QUEUE_TIMEOUT_SECONDS. Anyone past that gets BUSY_ERROR straight away.
+SANDBOX_NODE_CONCURRENCY = int(os.getenv("SANDBOX_NODE_CONCURRENCY", str(os.cpu_count() or 2)))
+SANDBOX_NODE_QUEUE_DEPTH = int(os.getenv("SANDBOX_NODE_QUEUE_DEPTH", "30"))
+
+TIMEOUT_ERROR = "Your code took too long to run."
+FAILED_ERROR = "Code execution failed."
+INVALID_RESPONSE_ERROR = "Invalid response from code runner."
+BUSY_ERROR = "The code runner is busy right now, please try again in a moment."
+# Errors that say something about the server rather than the submitted code.
+RUNNER_ERRORS = {TIMEOUT_ERROR, FAILED_ERROR, INVALID_RESPONSE_ERROR, BUSY_ERROR}
+
 
 # gets unit info
 def get_unit_data(unit_name):
-    return ANSWER_KEYS.get(unit_name)
+    return answer_keys.current().unit(unit_name)
 
 
-with open(ANSWER_PATH, "r") as f:
-    ANSWER_KEYS = json.load(f)
+class SandboxWorker:
+    """A pre-imported sandbox_runner process that answers one job per line."""
 
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, RUNNER_PATH, "--worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            close_fds=True,
+        )
+        self.jobs = 0
+        self.ready = False
+        self.eof = False
+        self._buffer = b""
 
-# main method
-def evaluate_submission(unit_name, code):
-    payload = json.dumps({"unit_name": unit_name, "code": code})
+    def _readline(self, timeout):
+        """Read one JSON line from the worker, or None on timeout/EOF."""
+        deadline = time.monotonic() + timeout
+        fd = self.proc.stdout.fileno()
+        while b"\n" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                return None
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                self.eof = True
+                return None
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        try:
+            return json.loads(line.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return {}
+
+    def start(self):
+        """Wait for the worker's ready line. Returns False if it never came."""
+        if not self.ready:
+            hello = self._readline(SANDBOX_STARTUP_TIMEOUT_SECONDS)
+            if not hello or not hello.get("ready"):
+                return False
+            self.ready = True
+        return True
+
+    def run(self, payload, timeout):
+        """Run one job. Returns (result, healthy)."""
+        if not self.start():
+            return {"error": FAILED_ERROR}, False
+
+        try:
+            self.proc.stdin.write(json.dumps(payload).encode("utf-8") + b"\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            return {"error": FAILED_ERROR}, False
+        self.jobs += 1
+
+        reply = self._readline(timeout)
+        if reply is None:
+            if not self.eof:
+                return {"error": TIMEOUT_ERROR}, False
+            # Killed by RLIMIT_CPU/RLIMIT_AS or crashed.
+            return {"error": FAILED_ERROR}, False
+        if "result" not in reply:
+            return {"error": INVALID_RESPONSE_ERROR}, False
+        return reply["result"], not reply.get("recycle")
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        try:
+            self.proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class SandboxPool:
+    """Fixed-size pool of SandboxWorkers with a bounded wait queue."""
+
+    def __init__(self, size, max_jobs_per_worker, queue_depth):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        # Callers that are running or waiting; anything beyond this is turned away.
+        self._admission = threading.BoundedSemaphore(size + queue_depth)
+        for _ in range(size):
+            self._idle.put(SandboxWorker())
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "jobs": 0,
+            "busy_rejections": 0,
+            "recycled": 0,
+            "busy_seconds": 0.0,
+            "wait_seconds": 0.0,
+        }
+
+    def _record(self, **amounts):
+        with self._stats_lock:
+            for name, amount in amounts.items():
+                self._stats[name] += amount
+
+    def stats(self):
+        """Counters since the pool started; busy_seconds / (size * elapsed) is utilisation."""
+        with self._stats_lock:
+            return dict(self._stats, size=self.size, idle=self._idle.qsize())
+
+    def run(self, payload, timeout=EXEC_TIMEOUT_SECONDS):
+        """Run payload on an idle worker."""
+        if not self._admission.acquire(blocking=False):
+            self._record(busy_rejections=1)
+            return {"error": BUSY_ERROR}
+        try:
+            queued = time.monotonic()
+            try:
+                worker = self._idle.get(timeout=SANDBOX_QUEUE_TIMEOUT_SECONDS)
+            except queue.Empty:
+                self._record(busy_rejections=1, wait_seconds=time.monotonic() - queued)
+                return {"error": BUSY_ERROR}
+
+            started = time.monotonic()
+            healthy = False
+            try:
+                result, healthy = worker.run(payload, timeout)
+            finally:
+                recycle = not healthy or worker.jobs >= self.max_jobs_per_worker
+                self._record(
+                    jobs=1,
+                    recycled=int(recycle),
+                    busy_seconds=time.monotonic() - started,
+                    wait_seconds=started - queued,
+                )
+                if recycle:
+                    # Start the replacement right away so it's warm for the next job.
+                    worker.stop()
+                    worker = SandboxWorker()
+                self._idle.put(worker)
+            return result
+        finally:
+            self._admission.release()
+
+    def warm(self):
+        """Wait until every idle worker has finished starting up."""
+        for worker in list(self._idle.queue):
+            worker.start()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return this process's sandbox pool, creating it on first use.
+
+    The pid check matters under pre-forking servers: a pool created in the
+    master must not be shared with forked workers.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = SandboxPool(
+                SANDBOX_POOL_SIZE, SANDBOX_MAX_JOBS_PER_WORKER, SANDBOX_QUEUE_DEPTH
+            )
+        return _pool
+
+
+def pool_metrics():
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        return []
+    stats = pool.stats()
+    return [
+        (f"bytequest_sandbox_{name}_total", {}, stats[name])
+        for name in ("jobs", "busy_rejections", "recycled", "busy_seconds", "wait_seconds")
+    ]
+
+
+metrics.register_collector(pool_metrics)
+
+
+NODE_RUN_SLOTS = node_sync.NodeSemaphore("sandbox_run", max(SANDBOX_NODE_CONCURRENCY, 1))
+NODE_ADMISSION = node_sync.NodeSemaphore(
+    "sandbox_admission", max(SANDBOX_NODE_CONCURRENCY, 1) + max(SANDBOX_NODE_QUEUE_DEPTH, 0)
+)
+
+
+def run_admitted(run, payload):
+    """Call run(payload) once one of the node's sandbox slots is free.
+
+    Returns BUSY_ERROR without running anything when the node's wait queue is
+    full or no slot frees up within SANDBOX_QUEUE_TIMEOUT_SECONDS.
+    """
+    if SANDBOX_NODE_CONCURRENCY <= 0:
+        return run(payload)
+    ticket = NODE_ADMISSION.acquire()
+    if ticket is None:
+        metrics.increment("bytequest_sandbox_node_rejections_total", reason="queue_full")
+        return {"error": BUSY_ERROR}
+    try:
+        queued = time.perf_counter()
+        slot = NODE_RUN_SLOTS.acquire(timeout=SANDBOX_QUEUE_TIMEOUT_SECONDS)
+        metrics.observe("bytequest_sandbox_node_wait_seconds", time.perf_counter() - queued)
+        if slot is None:
+            metrics.increment("bytequest_sandbox_node_rejections_total", reason="timeout")
+            return {"error": BUSY_ERROR}
+        try:
+            metrics.increment("bytequest_sandbox_node_admitted_total")
+            return run(payload)
+        finally:
+            NODE_RUN_SLOTS.release(slot)
+    finally:
+        NODE_ADMISSION.release(ticket)
+
+
+def run_once(payload):
+    """Run a single job in a throwaway sandbox process (no pool)."""
     try:
         result = subprocess.run(
             [sys.executable, RUNNER_PATH],
-            input=payload.encode("utf-8"),
+            input=json.dumps(payload).encode("utf-8"),
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             timeout=EXEC_TIMEOUT_SECONDS,
             check=False,
         )
     except subprocess.TimeoutExpired:
-        return {"error": "Your code took too long to run."}
+        return {"error": TIMEOUT_ERROR}
 
     if result.returncode != 0:
-        return {"error": "Code execution failed."}
+        return {"error": FAILED_ERROR}
 
     try:
         return json.loads(result.stdout.decode("utf-8"))
     except json.JSONDecodeError:
-        return {"error": "Invalid response from code runner."}
+        return {"error": INVALID_RESPONSE_ERROR}
+
+
+def is_cacheable(result):
+    """Only cache outcomes that depend on the code alone.
+
+    Compile errors are left out: they are cheap to recompute and carry line
+    numbers that the AST-based cache key deliberately ignores. So are runs
+    that hit a test case's CPU budget, since code near the budget can pass
+    on a less loaded machine.
+    """
+    errors = [result.get("error")] + [case["error"] for case in result.get("cases", ())]
+    if sandbox_runner.CASE_TIMEOUT_ERROR in errors:
+        return False
+    error = result.get("error")
+    if error is None:
+        return True
+    return error not in RUNNER_ERRORS and not error.startswith("Code compilation error")
+
+
+def build_payload(answers, unit_name, code, stop_on_first_failure=None):
+    """The sandbox request for one submission: the code plus the unit's compact key."""
+    payload = {"unit_name": unit_name, "code": code, "key": answers.grading_key(unit_name)}
+    if stop_on_first_failure is not None:
+        payload["stop_on_first_failure"] = bool(stop_on_first_failure)
+    return payload
+
+
+# main method
+def evaluate_submission(unit_name, code, stop_on_first_failure=None):
+    """Grade code for a unit.
+
+    stop_on_first_failure overrides the unit's setting for multi-case units.
+    The result records the answer key version it was graded against and,
+    unless it came from the cache, the run's resource "usage".
+    """
+    answers = answer_keys.current()
+    cache_unit = unit_name
+    if stop_on_first_failure is not None:
+        cache_unit = f"{unit_name}:stop={int(bool(stop_on_first_failure))}"
+    cache_key = submission_cache.make_key(cache_unit, answers.version, code)
+    cached = submission_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    payload = build_payload(answers, unit_name, code, stop_on_first_failure)
+    started = time.perf_counter()
+    with metrics.span("sandbox"):
+        if SANDBOX_POOL_SIZE <= 0:
+            result = run_admitted(run_once, payload)
+        else:
+            result = run_admitted(get_pool().run, payload)
+    # The runner reports what the run cost; if it was killed or timed out we
+    # only know how long we waited for it.
+    usage = result.pop("usage", None) or {"wall_seconds": round(time.perf_counter() - started, 6)}
+    result["answer_key_version"] = answers.version
+
+    # Usage describes this particular run, so it isn't cached with the outcome
+    if is_cacheable(result):
+        submission_cache.put(cache_key, result)
+    result["usage"] = usage
+    return result
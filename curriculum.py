@@ -0,0 +1,173 @@
+import json
+import os
+
+BASE_DIR = os.path.dirname(__file__)
+CURRICULUM_PATH = os.path.join(BASE_DIR, "data", "curriculum.json")
+
+
+class InvalidCurriculum(ValueError):
+    pass
+
+
+class Curriculum:
+    """data/curriculum.json compiled into lookup tables.
+
+    Units are kept in file order, which is the order the navigation shows. A
+    unit's "requires" lists the units whose practice has to be completed
+    before it opens; they must come earlier in the file, so file order is
+    also an order in which every unit comes after its prerequisites.
+    """
+
+    def __init__(self, data):
+        if not isinstance(data, dict) or not isinstance(data.get("units"), list):
+            raise InvalidCurriculum("curriculum needs a \"units\" list")
+        self.units = []
+        self.unit_index = {}
+        self.lessons = {}
+        self.sequence = []
+        self.requires = {}
+        for unit in data["units"]:
+            self._add_unit(unit)
+
+        # Reading order across units, for the previous/next article links
+        for index, meta in enumerate(self.sequence):
+            meta["index"] = index
+        self.previous_lesson = {}
+        self.next_lesson = {}
+        for before, after in zip([None] + self.sequence, self.sequence + [None]):
+            if after is not None:
+                self.previous_lesson[(after["unit"], after["slug"])] = before
+            if before is not None:
+                self.next_lesson[(before["unit"], before["slug"])] = after
+
+        numbers = [unit["unit"] for unit in self.units]
+        self.next_unit = {
+            number: self.unit_index[after] if after is not None else None
+            for number, after in zip(numbers, numbers[1:] + [None])
+        }
+        self.first_lesson = {
+            unit["unit"]: unit["lessons"][0] if unit["lessons"] else None for unit in self.units
+        }
+
+        # Units whose unlock status can change when `number`'s progress does:
+        # the unit itself and everything that requires it, directly or not,
+        # in evaluation order.
+        dependents = {number: [] for number in numbers}
+        for number in numbers:
+            for required in self.requires[number]:
+                dependents[required].append(number)
+        self.downstream = {}
+        for number in reversed(numbers):
+            reached = {number}
+            for dependent in dependents[number]:
+                reached.update(self.downstream[dependent])
+            self.downstream[number] = tuple(n for n in numbers if n in reached)
+
+    def _add_unit(self, unit):
+        if not isinstance(unit, dict):
+            raise InvalidCurriculum("each unit must be an object")
+        number = unit.get("unit")
+        if not isinstance(number, int) or isinstance(number, bool):
+            raise InvalidCurriculum(f"unit number must be an integer, got {number!r}")
+        if number in self.unit_index:
+            raise InvalidCurriculum(f"unit {number} is listed twice")
+        requires = unit.get("requires", [])
+        for required in requires:
+            if required not in self.unit_index:
+                raise InvalidCurriculum(
+                    f"unit {number} requires unit {required}, which must be listed before it"
+                )
+
+        entry = {
+            "unit": number,
+            "title": unit.get("title", ""),
+            "requires": tuple(requires),
+            "lessons": [],
+        }
+        for lesson in unit.get("lessons", []):
+            slug = lesson.get("slug")
+            if not slug or (number, slug) in self.lessons:
+                raise InvalidCurriculum(f"unit {number} has a missing or repeated lesson slug {slug!r}")
+            meta = {
+                "unit": number,
+                "unit_title": entry["title"],
+                "slug": slug,
+                "title": lesson.get("title", slug),
+                "template": lesson.get("template") or f"articles/{number}/{slug}.html",
+            }
+            entry["lessons"].append(meta)
+            self.sequence.append(meta)
+            self.lessons[(number, slug)] = meta
+        entry["slugs"] = frozenset(meta["slug"] for meta in entry["lessons"])
+
+        self.units.append(entry)
+        self.unit_index[number] = entry
+        self.requires[number] = entry["requires"]
+
+    def _evaluate_unit(self, number, unit_progress, units):
+        """Unlock status of one unit, given the already-evaluated status of its prerequisites."""
+        slugs = self.unit_index[number]["slugs"]
+        lessons_read = slugs.intersection(unit_progress.get("lessons_read", ()))
+        practice_completed = bool(unit_progress.get("practice_completed"))
+        # A prerequisite only counts once it was open and its practice is done
+        article_unlocked = all(
+            units[required]["article_unlocked"] and units[required]["practice_completed"]
+            for required in self.requires[number]
+        )
+        all_lessons_read = article_unlocked and len(lessons_read) >= len(slugs)
+        return {
+            "article_unlocked": article_unlocked,
+            "practice_unlocked": all_lessons_read or practice_completed,
+            "practice_completed": practice_completed,
+            "lessons_read": sorted(lessons_read),
+            "lessons_read_count": len(lessons_read),
+            "lessons_total": len(slugs),
+        }
+
+    def evaluate(self, progress_map):
+        """Per-unit lock/unlock status for a user's saved progress ({unit: {"lessons_read", "practice_completed"}})."""
+        units = {}
+        for unit in self.units:
+            number = unit["unit"]
+            units[number] = self._evaluate_unit(number, progress_map.get(number, {}), units)
+        return {"units": units}
+
+    def advance(self, state, number, read_slug=None, practice_completed=False):
+        """Return a new state with one unit's progress changed.
+
+        Only `number` and the units downstream of it are re-evaluated; the rest
+        are shared with `state`.
+        """
+        if number not in self.unit_index:
+            return state
+        units = dict(state["units"])
+        current = units[number]
+        unit_progress = {
+            "lessons_read": set(current["lessons_read"]),
+            "practice_completed": current["practice_completed"] or practice_completed,
+        }
+        if read_slug is not None:
+            unit_progress["lessons_read"].add(read_slug)
+        for affected in self.downstream[number]:
+            if affected == number:
+                progress = unit_progress
+            else:
+                progress = units[affected]
+            units[affected] = self._evaluate_unit(affected, progress, units)
+        return {"units": units}
+
+
+def load(path=CURRICULUM_PATH):
+    with open(path, encoding="utf-8") as f:
+        return Curriculum(json.load(f))
+
+
+_current = None
+
+
+def current():
+    """The curriculum this process loaded at startup."""
+    global _current
+    if _current is None:
+        _current = load()
+    return _current
@@ -1,30 +1,298 @@
 # http://flask.pocoo.org/docs/1.0/tutorial/database/
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
 
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+
+import metrics
+
+# Every worker talks to the database through one pooled SQLAlchemy engine per
+# URL: SQLite by default (a file next to the app), PostgreSQL when
+# SQLALCHEMY_DATABASE_URI / DATABASE_URL points at a server. Queries are plain
+# SQL with :name parameters and a dict of values, run on the pooled DB-API
+# connection; get_db() hides the few differences between the drivers. As with
+# SQLAlchemy's text(), a literal can't contain a colon directly followed by a
+# name (bind such values instead). A request checks a connection out
+# on its first query and hands it back when the app context ends.
+_engines = {}
+_engines_lock = threading.Lock()
+
+class DatabaseError(Exception):
+    """A statement failed, whichever driver ran it."""
+
+class Row:
+    """A result row readable by position or by column name, like sqlite3.Row."""
+
+    __slots__ = ("_names", "_values")
+
+    def __init__(self, names, values):
+        self._names = names
+        self._values = tuple(values)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._names[key]]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return list(self._names)
+
+class Cursor:
+    """Wraps a non-SQLite cursor so its rows behave like sqlite3.Row."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._names = None
+
+    def _row(self, values):
+        if values is None:
+            return None
+        if self._names is None:
+            self._names = {column[0]: index for index, column in enumerate(self._cursor.description)}
+        return Row(self._names, values)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._row(values) for values in self._cursor.fetchall()]
+
+    def __iter__(self):
+        for values in self._cursor:
+            yield self._row(values)
+
+@lru_cache(maxsize=512)
+def _compiled(sql, dialect):
+    """The statement in the driver's own paramstyle, and its parameter order if positional.
+
+    sqlite3 binds :name parameters itself; other drivers get the statement
+    compiled by SQLAlchemy's text(), which also escapes literal % for them.
+    """
+    compiled = text(sql).compile(dialect=dialect)
+    return str(compiled), compiled.positiontup if compiled.positional else None
+
+def _verb(sql):
+    word = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+    return word if word in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+class Database:
+    """One pooled connection, with the sqlite3-style calls the app uses.
+
+    Each statement and commit is timed as a "db" span and in
+    bytequest_db_statement_seconds (see metrics.py).
+    """
+
+    def __init__(self, connection, dialect, errors):
+        self._connection = connection
+        self._dialect = dialect
+        self.dialect = dialect.name
+        self._sqlite = dialect.name == "sqlite"
+        self._errors = errors
+
+    @contextmanager
+    def _timed(self, statement):
+        started = time.perf_counter()
+        try:
+            with metrics.span("db"):
+                yield
+        except self._errors as exc:
+            raise DatabaseError(str(exc)) from exc
+        finally:
+            metrics.observe("bytequest_db_statement_seconds", time.perf_counter() - started, statement=statement)
+
+    def _statement(self, sql, seq_of_params):
+        if self._sqlite:
+            return sql, seq_of_params
+        statement, order = _compiled(sql, self._dialect)
+        if order is not None:
+            seq_of_params = [tuple(params[name] for name in order) for params in seq_of_params]
+        return statement, seq_of_params
+
+    def _cursor(self, cursor):
+        return cursor if self._sqlite else Cursor(cursor)
+
+    def execute(self, sql, params=None):
+        """Run one statement; params is a dict for its :name parameters."""
+        cursor = self._connection.cursor()
+        statement, (params,) = self._statement(sql, [params or {}])
+        with self._timed(_verb(sql)):
+            cursor.execute(statement, params)
+        return self._cursor(cursor)
+
+    def executemany(self, sql, seq_of_params):
+        cursor = self._connection.cursor()
+        statement, seq_of_params = self._statement(sql, list(seq_of_params))
+        with self._timed(_verb(sql)):
+            cursor.executemany(statement, seq_of_params)
+        return self._cursor(cursor)
+
+    def executescript(self, script):
+        """Run several statements; on SQLite this commits any open transaction first."""
+        with self._timed("SCRIPT"):
+            if self._sqlite:
+                self._connection.driver_connection.executescript(script)
+            else:
+                self._connection.cursor().execute(script)
+
+    def commit(self):
+        with self._timed("COMMIT"):
+            self._connection.commit()
+
+    def rollback(self):
+        with self._timed("ROLLBACK"):
+            self._connection.rollback()
+
+    def close(self):
+        """Hand the connection back to the pool, which rolls back anything uncommitted."""
+        self._connection.close()
+
+def database_url(config):
+    """SQLALCHEMY_DATABASE_URI if set, else the SQLite file at DATABASE."""
+    return config.get("SQLALCHEMY_DATABASE_URI") or "sqlite:///" + config["DATABASE"]
+
+def _sqlite_setup(config):
+    pragmas = (
+        f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA cache_size = {int(config['SQLITE_CACHE_SIZE'])}",
+    )
+
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.row_factory = sqlite3.Row
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return connect
+
+def _create_engine(config):
+    url = make_url(database_url(config))
+    options = {
+        "pool_size": int(config["DATABASE_POOL_SIZE"]),
+        "max_overflow": int(config["DATABASE_MAX_OVERFLOW"]),
+        "pool_timeout": float(config["DATABASE_POOL_TIMEOUT"]),
+        "pool_recycle": int(config["DATABASE_POOL_RECYCLE"]),
+        "pool_pre_ping": bool(config["DATABASE_POOL_PRE_PING"]),
+        # Reuse the most recently returned connection, so idle ones can age out
+        "pool_use_lifo": True,
+    }
+    if url.get_backend_name() == "sqlite":
+        # sqlite3 caches compiled statements per connection (keyed by the SQL
+        # text), so pooled connections keep the hot queries prepared
+        options["connect_args"] = {
+            "timeout": config["SQLITE_BUSY_TIMEOUT_MS"] / 1000,
+            "detect_types": sqlite3.PARSE_DECLTYPES,
+            "cached_statements": config["SQLITE_STATEMENT_CACHE_SIZE"],
+        }
+    engine = create_engine(url, **options)
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine, "connect", _sqlite_setup(config))
+    return engine
+
+def get_engine(config=None):
+    """This process's pooled engine for the app's database.
+
+    The pid check matters under pre-forking servers: connections opened in the
+    master are left alone (not closed) by forked workers, which start their
+    own pool.
+    """
+    config = config if config is not None else current_app.config
+    url = database_url(config)
+    with _engines_lock:
+        entry = _engines.get(url)
+        if entry is not None and entry[0] != os.getpid():
+            entry[1].dispose(close=False)
+            entry = None
+        if entry is None:
+            entry = _engines[url] = (os.getpid(), _create_engine(config))
+    return entry[1]
 
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(
-            "sqlite_db", detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        engine = get_engine()
+        started = time.perf_counter()
+        try:
+            connection = engine.raw_connection()
+        except SQLAlchemyError as exc:
+            if isinstance(exc, PoolTimeoutError):
+                metrics.increment("bytequest_db_pool_timeouts_total")
+            raise DatabaseError(str(exc)) from exc
+        finally:
+            metrics.observe("bytequest_db_pool_wait_seconds", time.perf_counter() - started)
+        g.db = Database(connection, engine.dialect, engine.dialect.loaded_dbapi.Error)
 
     return g.db
 
 def close_db(e=None):
-    db = g.pop("db", None)
+    """Hand this app context's connection back to the pool.
 
+    Also called before long waits (sandbox runs, long-polls) so a request
+    doesn't sit on a connection it isn't using; the next get_db() checks out
+    another one.
+    """
+    db = g.pop("db", None)
     if db is not None:
         db.close()
 
+def dispose_engines():
+    """Close every pooled connection of this process, e.g. before the server forks."""
+    with _engines_lock:
+        for pid, engine in _engines.values():
+            if pid == os.getpid():
+                engine.dispose()
+        _engines.clear()
+
+def pool_metrics():
+    collected = []
+    with _engines_lock:
+        engines = [engine for pid, engine in _engines.values() if pid == os.getpid()]
+    for engine in engines:
+        pool = engine.pool
+        if not hasattr(pool, "checkedout"):
+            continue
+        labels = {"database": engine.url.get_backend_name()}
+        collected += [
+            ("bytequest_db_pool_size", labels, pool.size()),
+            ("bytequest_db_pool_checked_out", labels, pool.checkedout()),
+            ("bytequest_db_pool_idle", labels, pool.checkedin()),
+            ("bytequest_db_pool_overflow", labels, max(pool.overflow(), 0)),
+        ]
+    return collected
+
+metrics.register_collector(pool_metrics)
+
+def schema_file(db):
+    """schema.sql for SQLite, schema_postgres.sql for PostgreSQL."""
+    return "schema.sql" if db.dialect == "sqlite" else "schema_postgres.sql"
+
 def init_db():
     db = get_db()
 
-    with current_app.open_resource("schema.sql") as f:
+    with current_app.open_resource(schema_file(db)) as f:
         db.executescript(f.read().decode("utf8"))
+    db.commit()
 
 @click.command("init-db")
 @with_appcontext
@@ -33,6 +301,69 @@ def init_db_command():
     init_db()
     click.echo("Initialized the database.")
 
+@click.command("regrade")
+@click.option("--unit", "unit_name", help="Only regrade submissions for this unit, e.g. unit2.")
+@click.option("--jobs", type=int, default=None, help="Runner processes to use (default: one per core).")
+@click.option("--batch-size", type=int, default=50, show_default=True, help="Submissions piped through one runner process at a time.")
+@click.option("--revoke", is_flag=True, help="Also clear practice completion for users left with no passing submission.")
+@with_appcontext
+def regrade_command(unit_name, jobs, batch_size, revoke):
+    """Re-grade stored submissions against the current answer key."""
+    from regrade import regrade_submissions
+
+    regrade_submissions(unit_name=unit_name, jobs=jobs, batch_size=batch_size, revoke=revoke)
+
+@click.command("sandbox-usage")
+@click.option("--unit", "unit_name", help="Only report this unit, e.g. unit2.")
+@click.option("--days", type=float, default=None, help="Only submissions from the last N days.")
+@with_appcontext
+def sandbox_usage_command(unit_name, days):
+    """Show per-unit CPU, wall time and peak memory of graded submissions next to the sandbox limits."""
+    import time
+
+    import codeEvaluator
+    import sandbox_runner
+    from submission_jobs import usage_by_unit
+
+    since = time.time() - days * 86400 if days else None
+    click.echo(
+        f"Limits: CPU {sandbox_runner.CPU_TIME_SECONDS}s per job, "
+        f"wall {codeEvaluator.EXEC_TIMEOUT_SECONDS}s, "
+        f"memory {sandbox_runner.MEMORY_LIMIT_BYTES // (1024 * 1024)} MiB"
+    )
+    formats = {
+        "cpu_seconds": ("CPU s", lambda v: f"{v:.3f}"),
+        "wall_seconds": ("wall s", lambda v: f"{v:.3f}"),
+        "peak_rss_bytes": ("peak MiB", lambda v: f"{v / (1024 * 1024):.1f}"),
+    }
+    for unit, columns in usage_by_unit(unit_name, since).items():
+        click.echo(f"{unit} ({columns['wall_seconds']['count']} runs)")
+        for column, (label, fmt) in formats.items():
+            stats = columns[column]
+            if not stats["count"]:
+                continue
+            click.echo(
+                f"  {label:<9} p50 {fmt(stats['p50'])}  p95 {fmt(stats['p95'])}  "
+                f"p99 {fmt(stats['p99'])}  max {fmt(stats['max'])}"
+            )
+
 def init_app(app):
+    """Register the CLI commands and pool settings.
+
+    DATABASE_POOL_SIZE connections are kept open per worker, and up to
+    DATABASE_MAX_OVERFLOW more are opened under load; a request waits up to
+    DATABASE_POOL_TIMEOUT seconds for one. Connections older than
+    DATABASE_POOL_RECYCLE seconds are replaced, and DATABASE_POOL_PRE_PING
+    checks each one before handing it out.
+    """
+    app.config.setdefault("DATABASE_POOL_SIZE", int(os.getenv("DATABASE_POOL_SIZE", "5")))
+    app.config.setdefault("DATABASE_MAX_OVERFLOW", int(os.getenv("DATABASE_MAX_OVERFLOW", "10")))
+    app.config.setdefault("DATABASE_POOL_TIMEOUT", float(os.getenv("DATABASE_POOL_TIMEOUT", "10")))
+    app.config.setdefault("DATABASE_POOL_RECYCLE", int(os.getenv("DATABASE_POOL_RECYCLE", "1800")))
+    app.config.setdefault(
+        "DATABASE_POOL_PRE_PING", os.getenv("DATABASE_POOL_PRE_PING", "1").lower() in ("1", "true", "yes")
+    )
     app.teardown_appcontext(close_db)
-    app.cli.add_command(init_db_command)
\ No newline at end of file
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(regrade_command)
+    app.cli.add_command(sandbox_usage_command)
\ No newline at end of file
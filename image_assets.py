@@ -0,0 +1,194 @@
+import glob
+import json
+import os
+import re
+
+import click
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+
+import static_assets
+
+# Widths (in px) to generate below an image's own width; the original width
+# is always included so large screens still get a sharp copy.
+IMAGE_WIDTHS = (320, 640, 1280)
+IMAGE_DIR = "images"
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png")
+MANIFEST_NAME = "images.json"
+
+# Newest format first: the browser picks the first <source> it supports.
+# Screenshots are mostly text, so quality is kept fairly high.
+FORMATS = (
+    ("avif", "image/avif", {"quality": 60}),
+    ("webp", "image/webp", {"quality": 80, "method": 6}),
+)
+
+DEFAULT_SIZES = "(max-width: 768px) 100vw, 768px"
+
+
+def manifest_path(static_folder):
+    return os.path.join(static_folder, static_assets.BUILD_DIR, MANIFEST_NAME)
+
+
+def _target_widths(width):
+    return sorted({w for w in IMAGE_WIDTHS if w < width} | {width})
+
+
+def build(static_folder, echo=None):
+    """Write AVIF/WebP copies of every image at each target width.
+
+    Variants go under static/build/ with the source's content hash in their
+    name, so they can be cached forever. Returns the manifest.
+    """
+    from PIL import Image, features  # only needed at build time
+
+    formats = [fmt for fmt in FORMATS if features.check(fmt[0])]
+    images = {}
+    for source in sorted(glob.glob(os.path.join(static_folder, IMAGE_DIR, "*"))):
+        if not source.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        rel = os.path.relpath(source, static_folder).replace(os.sep, "/")
+        stem = os.path.splitext(rel)[0]
+        digest = static_assets.fingerprint(source)
+
+        with Image.open(source) as original:
+            original.load()
+            width, height = original.size
+            if original.mode not in ("RGB", "RGBA"):
+                original = original.convert("RGBA" if "transparency" in original.info else "RGB")
+            variants = {}
+            for name, mimetype, options in formats:
+                variants[name] = []
+                for target_width in _target_widths(width):
+                    path = f"{static_assets.BUILD_DIR}/{stem}.{digest}.{target_width}.{name}"
+                    target = os.path.join(static_folder, path)
+                    if not os.path.exists(target):
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        if target_width == width:
+                            resized = original
+                        else:
+                            resized = original.resize(
+                                (target_width, max(1, round(height * target_width / width))),
+                                Image.LANCZOS,
+                            )
+                        resized.save(target + ".tmp", format=name.upper(), **options)
+                        os.replace(target + ".tmp", target)
+                    variants[name].append({
+                        "path": path,
+                        "width": target_width,
+                        "bytes": os.path.getsize(target),
+                    })
+
+        images[rel] = {
+            "width": width,
+            "height": height,
+            "bytes": os.path.getsize(source),
+            "variants": variants,
+        }
+        if echo:
+            best = {name: entries[-1]["bytes"] for name, entries in variants.items()}
+            echo(f"{rel}: {width}x{height}, {images[rel]['bytes']} bytes -> {best}")
+
+    manifest = {"images": images}
+    os.makedirs(os.path.dirname(manifest_path(static_folder)), exist_ok=True)
+    with open(manifest_path(static_folder) + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path(static_folder) + ".tmp", manifest_path(static_folder))
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(manifest_path(static_folder), encoding="utf-8") as f:
+            return json.load(f).get("images", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def picture(filename, alt="", sizes=DEFAULT_SIZES):
+    """Jinja helper: a lazily-loaded <picture> with AVIF/WebP sources for `filename`.
+
+    Falls back to a plain lazy <img> for images the pipeline hasn't processed.
+    """
+    entry = current_app.extensions.get("image_assets", {}).get(filename)
+    img_attrs = f'src="{escape(url_for("static", filename=filename))}" alt="{escape(alt)}" loading="lazy" decoding="async"'
+    if entry is None:
+        return Markup(f"<img {img_attrs}>")
+
+    img_attrs += f' width="{entry["width"]}" height="{entry["height"]}"'
+    sources = []
+    for name, mimetype, _ in FORMATS:
+        variants = entry["variants"].get(name)
+        if not variants:
+            continue
+        srcset = ", ".join(
+            f'{url_for("static", filename=variant["path"])} {variant["width"]}w' for variant in variants
+        )
+        sources.append(f'<source type="{mimetype}" srcset="{escape(srcset)}" sizes="{escape(sizes)}">')
+    return Markup(f"<picture>{''.join(sources)}<img {img_attrs}></picture>")
+
+
+PICTURE_CALL = re.compile(r"""picture\(\s*['"]([^'"]+)['"]""")
+
+
+def savings_report(template_folder, images):
+    """Bytes each article's images cost before and after, at full width.
+
+    Returns (article, original_bytes, {format: bytes}) rows, one per article.
+    """
+    rows = []
+    pattern = os.path.join(template_folder, "articles", "*", "*.html")
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding="utf-8") as f:
+            filenames = PICTURE_CALL.findall(f.read())
+        if not filenames:
+            continue
+        article = os.path.relpath(path, template_folder).replace(os.sep, "/")
+        original = 0
+        totals = {name: 0 for name, _, _ in FORMATS}
+        for filename in filenames:
+            entry = images.get(filename)
+            if entry is None:
+                continue
+            original += entry["bytes"]
+            for name in totals:
+                variants = entry["variants"].get(name)
+                # Browsers without this format keep downloading the original
+                totals[name] += variants[-1]["bytes"] if variants else entry["bytes"]
+        if original:
+            rows.append((article, original, totals))
+    return rows
+
+
+@click.command("build-images")
+@click.option("--report-only", is_flag=True, help="Only print the bytes-saved report for the existing build.")
+@with_appcontext
+def build_images_command(report_only):
+    """Generate AVIF/WebP image variants and report bytes saved per article."""
+    static_folder = current_app.static_folder
+    if report_only:
+        images = load_manifest(static_folder)
+    else:
+        images = build(static_folder, echo=click.echo)["images"]
+
+    grand_original = 0
+    grand = {name: 0 for name, _, _ in FORMATS}
+    for article, original, totals in savings_report(current_app.template_folder, images):
+        grand_original += original
+        parts = []
+        for name, size in totals.items():
+            grand[name] += size
+            parts.append(f"{name} {size} (-{100 * (original - size) / original:.0f}%)")
+        click.echo(f"{article}: {original} bytes -> " + ", ".join(parts))
+    if grand_original:
+        click.echo(
+            f"total: {grand_original} bytes -> "
+            + ", ".join(f"{name} {size} (saves {grand_original - size})" for name, size in grand.items())
+        )
+
+
+def init_app(app):
+    app.cli.add_command(build_images_command)
+    app.extensions["image_assets"] = load_manifest(app.static_folder)
+    app.jinja_env.globals["picture"] = picture
@@ -0,0 +1,41 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+
+@click.command("compile-templates")
+@with_appcontext
+def compile_templates_command():
+    """Compile every template into the bytecode cache (run before starting workers)."""
+    if current_app.jinja_env.bytecode_cache is None:
+        raise click.ClickException("JINJA_BYTECODE_CACHE_DIR is empty, so there is no cache to fill")
+    names = current_app.jinja_env.list_templates()
+    for name in names:
+        current_app.jinja_env.get_template(name)
+    click.echo(f"Compiled {len(names)} templates into {current_app.config['JINJA_BYTECODE_CACHE_DIR']}")
+
+
+def init_app(app):
+    """Keep compiled templates in JINJA_BYTECODE_CACHE_DIR across worker restarts.
+
+    Jinja checks each entry against the template's source, so an edited
+    template is simply recompiled. Set JINJA_BYTECODE_CACHE_DIR to "" to turn
+    the cache off.
+    """
+    app.config.setdefault(
+        "JINJA_BYTECODE_CACHE_DIR",
+        os.getenv("JINJA_BYTECODE_CACHE_DIR", os.path.join(app.instance_path, "jinja_cache")),
+    )
+    app.cli.add_command(compile_templates_command)
+
+    directory = app.config["JINJA_BYTECODE_CACHE_DIR"]
+    if not directory:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
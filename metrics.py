@@ -0,0 +1,379 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import (
+    Response,
+    abort,
+    before_render_template,
+    current_app,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+
+import node_sync
+
+# Each process keeps its own histograms and writes a snapshot to
+# RUN_DIR/metrics/<pid>-<start time>.json every FLUSH_SECONDS (and right
+# before serving /metrics), so any worker can answer /metrics for the whole
+# node. Totals of workers that have exited are folded into RETIRED_NAME, so
+# they never go backwards.
+METRICS_DIR = os.path.join(node_sync.RUN_DIR, "metrics")
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+RETIRED_NAME = "retired.json"
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "bytequest_request_duration_seconds": "Time spent handling a request, by endpoint.",
+    "bytequest_span_duration_seconds": "Time spent in one instrumented operation (db, sandbox, render, oauth).",
+    "bytequest_requests_total": "Requests handled, by endpoint and status code.",
+    "bytequest_sandbox_node_wait_seconds": "Time a submission waited for a node-wide sandbox slot.",
+    "bytequest_sandbox_node_rejections_total": "Submissions turned away as busy by the node-wide sandbox limit, by reason.",
+    "bytequest_submission_inflight_rejections_total": "Submissions refused because the user already had one running.",
+    "bytequest_submission_coalesced_total": "Submissions answered with the result of an identical one already being graded.",
+    "bytequest_user_cache_loads_total": "Users loaded for authenticated requests.",
+    "bytequest_user_cache_hits_total": "User loads answered from the worker's cache, without a database query.",
+    "bytequest_user_cache_misses_total": "User loads that had to query the database.",
+    "bytequest_submission_cache_memory_hits_total": "Graded results served from this worker's memory cache.",
+    "bytequest_submission_cache_disk_hits_total": "Graded results served from the node's disk cache.",
+    "bytequest_submission_cache_misses_total": "Submissions not found in the result cache.",
+    "bytequest_submission_cache_stores_total": "Graded results added to the result cache.",
+    "bytequest_db_statement_seconds": "Time spent running one database statement, by kind of statement.",
+    "bytequest_db_pool_wait_seconds": "Time a request waited for a pooled database connection.",
+    "bytequest_db_pool_timeouts_total": "Requests that gave up waiting for a pooled database connection.",
+    "bytequest_db_pool_size": "Database connections each worker keeps open.",
+    "bytequest_db_pool_checked_out": "Database connections currently in use.",
+    "bytequest_db_pool_idle": "Open database connections waiting in the pool.",
+    "bytequest_db_pool_overflow": "Connections opened beyond the pool size under load.",
+}
+
+# Collected values that go up and down. Only live processes' values are
+# summed, unlike counters.
+GAUGES = {
+    "bytequest_db_pool_size",
+    "bytequest_db_pool_checked_out",
+    "bytequest_db_pool_idle",
+    "bytequest_db_pool_overflow",
+}
+
+_histograms = {}
+_counters = {}
+_collectors = []
+_lock = threading.Lock()
+_state = {"pid": None, "name": None, "flushed_at": 0.0}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][index] += 1
+                break
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+def increment(name, amount=1, **labels):
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_collector(collect):
+    """Add a callable returning [(metric_name, labels_dict, value), ...] of this process's counters (or GAUGES)."""
+    _collectors.append(collect)
+
+
+def record_span(name, seconds):
+    observe("bytequest_span_duration_seconds", seconds, span=name)
+    if has_request_context():
+        spans = g.setdefault("metric_spans", {})
+        total, count = spans.get(name, (0.0, 0))
+        spans[name] = (total + seconds, count + 1)
+
+
+@contextmanager
+def span(name):
+    """Time the block as one `name` span of the current request."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def _snapshot():
+    with _lock:
+        histograms = [
+            {"name": name, "labels": dict(labels), **dict(value, buckets=list(value["buckets"]))}
+            for (name, labels), value in _histograms.items()
+        ]
+        counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in _counters.items()]
+    for collect in _collectors:
+        try:
+            collected = collect()
+        except Exception:
+            continue
+        for name, labels, value in collected:
+            counters.append({"name": name, "labels": labels, "value": value})
+    return {"histograms": histograms, "counters": counters}
+
+
+def _start_time(pid):
+    """When process `pid` started (clock ticks since boot), or None if it isn't running or there is no /proc."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Field 22; the command name before it is in parentheses and may contain spaces
+    return int(stat.rsplit(b")", 1)[1].split()[19])
+
+
+def _snapshot_name(pid):
+    # Plus the start time, so a recycled pid never takes over a dead worker's file
+    start = _start_time(pid)
+    return f"{pid}-{start if start is not None else time.time_ns()}"
+
+
+def _alive(name):
+    pid, _, start = name.partition("-")
+    if start and os.path.isdir("/proc/self"):
+        return str(_start_time(int(pid))) == start
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, just not ours
+        pass
+    return True
+
+
+def flush(force=False):
+    """Write this process's snapshot if it is due (or force)."""
+    now = time.monotonic()
+    pid = os.getpid()
+    if pid != _state["pid"]:
+        # Forked: don't report the parent's numbers as ours
+        with _lock:
+            if _state["pid"] is not None:
+                _histograms.clear()
+                _counters.clear()
+            _state["pid"] = pid
+            _state["name"] = _snapshot_name(pid)
+            _state["flushed_at"] = now
+    if not force and now - _state["flushed_at"] < FLUSH_SECONDS:
+        return
+    _state["flushed_at"] = now
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{_state['name']}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(_snapshot(), f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None):
+    items = sorted(labels.items()) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _add(snapshot, histograms, counters, gauges=True):
+    """Sum a snapshot into {(name, labels): ...} dicts."""
+    for item in snapshot.get("histograms", []):
+        key = (item["name"], _labels_key(item["labels"]))
+        total = histograms.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        for index, value in enumerate(item["buckets"][:len(BUCKETS)]):
+            total["buckets"][index] += value
+        total["sum"] += item["sum"]
+        total["count"] += item["count"]
+    for item in snapshot.get("counters", []):
+        if not gauges and item["name"] in GAUGES:
+            continue
+        key = (item["name"], _labels_key(item["labels"]))
+        counters[key] = counters.get(key, 0) + item["value"]
+
+
+def _as_snapshot(histograms, counters):
+    return {
+        "histograms": [{"name": name, "labels": dict(labels), **value} for (name, labels), value in histograms.items()],
+        "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in counters.items()],
+    }
+
+
+@contextmanager
+def _directory_lock():
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    fd = os.open(os.path.join(METRICS_DIR, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _collect():
+    """Sum the snapshots of live processes and the retained totals of exited ones.
+
+    An exited process's counters and histograms are folded into
+    RETIRED_NAME and its snapshot removed, so the directory doesn't grow
+    with every restart and totals never go backwards. Its gauges are
+    dropped. The folded snapshot names are recorded next to the totals,
+    so a crash between writing them and removing the snapshot can't count
+    it twice.
+    """
+    histograms = {}
+    counters = {}
+    retired_path = os.path.join(METRICS_DIR, RETIRED_NAME)
+    with _directory_lock():
+        retired = _load(retired_path) or {}
+        retired_histograms = {}
+        retired_counters = {}
+        _add(retired, retired_histograms, retired_counters)
+        folded = set(retired.get("folded", []))
+        exited = []
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            name = os.path.basename(path)[:-len(".json")]
+            if not name.partition("-")[0].isdigit():
+                continue
+            if name in folded:
+                exited.append(path)
+                continue
+            snapshot = _load(path)
+            if snapshot is None:
+                continue
+            if _alive(name):
+                _add(snapshot, histograms, counters)
+            else:
+                _add(snapshot, retired_histograms, retired_counters, gauges=False)
+                folded.add(name)
+                exited.append(path)
+        if exited:
+            remaining = {os.path.basename(path)[:-len(".json")] for path in exited}
+            retired = dict(_as_snapshot(retired_histograms, retired_counters), folded=sorted(remaining))
+            with open(retired_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(retired, f)
+            os.replace(retired_path + ".tmp", retired_path)
+            for path in exited:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+    _add(retired, histograms, counters)
+    return histograms, counters
+
+
+def render_prometheus():
+    """Sum every process's snapshot and format it in the Prometheus text format."""
+    histograms, counters = _collect()
+
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), value in sorted(histograms.items()):
+            if metric != name:
+                continue
+            labels = dict(labels)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, value["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    for name in sorted({name for name, _ in counters}):
+        if name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} {'gauge' if name in GAUGES else 'counter'}")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{_format_labels(dict(labels))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _before_render(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault("metric_render_starts", []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    starts = g.get("metric_render_starts") if has_request_context() else None
+    if starts:
+        record_span("render", time.perf_counter() - starts.pop())
+
+
+def init_app(app):
+    """Time every request and its spans, and serve /metrics.
+
+    With METRICS_SERVER_TIMING on, responses carry a Server-Timing header
+    with the per-request span breakdown. /metrics only answers clients in
+    METRICS_ALLOWED_IPS.
+    """
+    app.config.setdefault("METRICS_SERVER_TIMING", False)
+    app.config.setdefault("METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"])
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+    @app.before_request
+    def start_request_timer():
+        g.metric_request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_request_timer(response):
+        started = g.pop("metric_request_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or "unmatched"
+        observe("bytequest_request_duration_seconds", elapsed, endpoint=endpoint)
+        increment("bytequest_requests_total", endpoint=endpoint, status=str(response.status_code))
+        if current_app.config["METRICS_SERVER_TIMING"]:
+            parts = [
+                f'{name};dur={1000 * total:.2f};desc="{count}x"'
+                for name, (total, count) in sorted(g.get("metric_spans", {}).items())
+            ]
+            parts.append(f"total;dur={1000 * elapsed:.2f}")
+            response.headers["Server-Timing"] = ", ".join(parts)
+        flush()
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        if request.remote_addr not in current_app.config["METRICS_ALLOWED_IPS"]:
+            abort(404)
+        flush(force=True)
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
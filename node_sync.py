@@ -0,0 +1,253 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+import zlib
+
+BASE_DIR = os.path.dirname(__file__)
+
+# Small shared files that let the web workers on one node coordinate without a
+# round-trip to SQLite.
+RUN_DIR = os.getenv("BYTEQUEST_RUN_DIR", os.path.join(BASE_DIR, "instance", "run"))
+
+
+class GenerationTable:
+    """Per-key change stamps shared by every process on the node.
+
+    Backed by a memory-mapped file of fixed slots; keys hash into a slot, so two
+    keys may share one. That only causes a spurious invalidation, never a
+    missed one. Writers call bump() after committing a change, readers call
+    current() before reading the data they are about to cache.
+    """
+
+    SLOT = struct.Struct("Q")
+
+    def __init__(self, name, slots=4096):
+        self.path = os.path.join(RUN_DIR, name)
+        self.slots = slots
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _mapping(self):
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    size = self.slots * self.SLOT.size
+                    os.makedirs(RUN_DIR, exist_ok=True)
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                    try:
+                        if os.fstat(fd).st_size < size:
+                            os.ftruncate(fd, size)
+                        self._map = mmap.mmap(fd, size)
+                    finally:
+                        os.close(fd)
+        return self._map
+
+    def _offset(self, key):
+        return (zlib.crc32(str(key).encode("utf-8")) % self.slots) * self.SLOT.size
+
+    def current(self, key):
+        """Return the key's stamp, or None if the table is unavailable."""
+        try:
+            return self.SLOT.unpack_from(self._mapping(), self._offset(key))[0]
+        except (OSError, ValueError):
+            return None
+
+    def bump(self, key):
+        try:
+            stamp = int.from_bytes(os.urandom(self.SLOT.size), "little")
+            self.SLOT.pack_into(self._mapping(), self._offset(key), stamp)
+        except (OSError, ValueError):
+            pass
+
+
+class NodeSemaphore:
+    """Caps how many holders, across every process on the node, are inside a section.
+
+    Each of the `limit` slots is a lock file, and holding a slot means holding
+    an flock on it, so a slot held by a worker that crashes frees itself.
+    acquire() returns a token to hand back to release(), or None when every
+    slot is taken. If the lock files can't be opened at all it lets the caller
+    through rather than taking the site down with it.
+    """
+
+    UNAVAILABLE = -1
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+
+    def _path(self, index):
+        return os.path.join(RUN_DIR, f"{self.name}.{index}.lock")
+
+    def _try_slot(self, index):
+        fd = os.open(self._path(index), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except OSError:
+            os.close(fd)
+            raise
+        return fd
+
+    def acquire(self, timeout=0):
+        deadline = time.monotonic() + timeout
+        try:
+            os.makedirs(os.path.dirname(self._path(0)), exist_ok=True)
+            while True:
+                # Start at a random slot so waiters don't all fight over slot 0
+                start = random.randrange(self.limit)
+                for i in range(self.limit):
+                    fd = self._try_slot((start + i) % self.limit)
+                    if fd is not None:
+                        return fd
+                if time.monotonic() >= deadline:
+                    return None
+                time.sleep(0.01)
+        except OSError:
+            return self.UNAVAILABLE
+
+    def release(self, token):
+        if token is None or token == self.UNAVAILABLE:
+            return
+        try:
+            fcntl.flock(token, fcntl.LOCK_UN)
+        finally:
+            os.close(token)
+
+
+class SingleFlight:
+    """Lets concurrent calls with the same key, from any process on the node, share one run.
+
+    The first caller holds an flock on the key's lock file while it runs fn()
+    and then leaves the JSON result next to it. Callers that arrive meanwhile
+    wait for the lock and return that result instead of running fn() again; if
+    the first caller died without writing one, the next in line runs fn().
+    """
+
+    def __init__(self, name, keep_seconds=60):
+        self.dir = os.path.join(RUN_DIR, name)
+        self.keep_seconds = keep_seconds
+        self._pruned_at = 0.0
+
+    def _paths(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        base = os.path.join(self.dir, digest[:2], digest)
+        return base + ".lock", base + ".json"
+
+    def run(self, key, fn, timeout):
+        """Return (result, shared); shared is True when another caller's run was reused."""
+        lock_path, result_path = self._paths(key)
+        try:
+            os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            return fn(), False
+        try:
+            waiting_since = time.time()
+            deadline = time.monotonic() + timeout
+            waited = False
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        # Whoever has it is stuck; don't wait on them forever
+                        return fn(), False
+                    waited = True
+                    time.sleep(0.02)
+            if waited:
+                result = self._read(result_path, waiting_since)
+                if result is not None:
+                    return result, True
+            result = fn()
+            self._write(result_path, result)
+        finally:
+            os.close(fd)
+        self._prune()
+        return result, False
+
+    def _read(self, path, since):
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Only a run that finished while we were waiting counts
+        if entry.get("finished_at", 0) < since:
+            return None
+        return entry.get("result")
+
+    def _write(self, path, result):
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"finished_at": time.time(), "result": result}, f)
+            os.replace(path + ".tmp", path)
+        except (OSError, TypeError, ValueError):
+            pass
+
+    def _prune(self):
+        """Remove results and idle lock files older than keep_seconds (at most once per keep_seconds)."""
+        now = time.time()
+        if now - self._pruned_at < self.keep_seconds:
+            return
+        self._pruned_at = now
+        for root, _, names in os.walk(self.dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if now - os.path.getmtime(path) < self.keep_seconds:
+                        continue
+                    if not name.endswith(".lock"):
+                        os.unlink(path)
+                        continue
+                    fd = os.open(path, os.O_RDWR)
+                    try:
+                        # Someone holding it is still running; leave it alone
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.unlink(path)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    continue
+
+
+def run_once(name, stamp, fn):
+    """Run fn() unless it already ran on this node for this stamp; returns whether it ran now.
+
+    For startup work that only needs doing once per deploy: the first worker
+    runs it, workers starting at the same time wait for it to finish, and
+    later ones just see the stamp file.
+    """
+    digest = hashlib.sha256(repr(stamp).encode("utf-8")).hexdigest()[:16]
+    done_path = os.path.join(RUN_DIR, "once", f"{name}.{digest}")
+    if os.path.exists(done_path):
+        return False
+    try:
+        os.makedirs(os.path.dirname(done_path), exist_ok=True)
+        fd = os.open(os.path.join(RUN_DIR, "once", f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError:
+        fn()
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if os.path.exists(done_path):
+            return False
+        fn()
+        with open(done_path, "w", encoding="utf-8") as f:
+            f.write(f"{time.time()}\n")
+        return True
+    finally:
+        os.close(fd)
+
+
+# Bumped whenever a user's lesson/practice progress changes.
+LEARNING_STATE_GENERATIONS = GenerationTable("learning_state.gen")
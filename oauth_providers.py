@@ -0,0 +1,340 @@
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+import node_sync
+
+logger = logging.getLogger(__name__)
+
+# msal, requests and oauthlib are imported on first use, not here: they add a
+# noticeable chunk to every worker's startup and most requests never log in.
+
+# Configuration
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", None)
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET", None)
+GOOGLE_DISCOVERY_URL = os.getenv(
+    "GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration"
+)
+
+# Microsoft OAuth Configuration
+MICROSOFT_CLIENT_ID = os.getenv("MICROSOFT_CLIENT_ID", None)
+MICROSOFT_CLIENT_SECRET = os.getenv("MICROSOFT_CLIENT_SECRET", None)
+MICROSOFT_TENANT_ID = os.getenv("MICROSOFT_TENANT_ID", "common")  # Use "common" for multi-tenant
+MICROSOFT_AUTHORITY_URL = os.getenv(
+    "MICROSOFT_AUTHORITY_URL", f"https://login.microsoftonline.com/{MICROSOFT_TENANT_ID}"
+)
+MICROSOFT_GRAPH_ME_URL = os.getenv("MICROSOFT_GRAPH_ME_URL", "https://graph.microsoft.com/v1.0/me")
+# Turn off for a local fake identity provider, which MSAL can't validate.
+MICROSOFT_VALIDATE_AUTHORITY = os.getenv("MICROSOFT_VALIDATE_AUTHORITY", "true").lower() not in ("0", "false", "no")
+
+# Discovery documents are fresh for DISCOVERY_TTL_SECONDS. After that the old
+# copy is still served for up to DISCOVERY_MAX_STALE_SECONDS while one
+# background request refreshes it.
+DISCOVERY_TTL_SECONDS = float(os.getenv("OAUTH_DISCOVERY_TTL_SECONDS", "3600"))
+DISCOVERY_MAX_STALE_SECONDS = float(os.getenv("OAUTH_DISCOVERY_MAX_STALE_SECONDS", "86400"))
+
+# Outbound calls give up after these, so a slow provider can't hold a worker.
+CONNECT_TIMEOUT_SECONDS = float(os.getenv("OAUTH_CONNECT_TIMEOUT_SECONDS", "3"))
+READ_TIMEOUT_SECONDS = float(os.getenv("OAUTH_READ_TIMEOUT_SECONDS", "5"))
+
+# After BREAKER_FAILURES failures in a row a provider's circuit opens and logins
+# through it fail fast for BREAKER_RESET_SECONDS, then one trial call is let in.
+BREAKER_FAILURES = int(os.getenv("OAUTH_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("OAUTH_BREAKER_RESET_SECONDS", "30"))
+
+# How many workers on this node may be inside a login callback at once.
+CALLBACK_CONCURRENCY = int(os.getenv("OAUTH_CALLBACK_CONCURRENCY", "4"))
+
+
+class ProviderUnavailable(Exception):
+    """The provider is degraded or too many logins are already in flight."""
+
+
+_counters = {
+    "timeouts": 0,
+    "failures": 0,
+    "breaker_trips": 0,
+    "breaker_rejections": 0,
+    "bulkhead_rejections": 0,
+}
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+class CircuitBreaker:
+    """Closed -> open after `failures` consecutive errors -> half-open after `reset_seconds`."""
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._consecutive = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial:
+                return False
+            # Let exactly one call through to see if the provider is back
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._trial = False
+
+    def release_trial(self):
+        """The trial call ended without showing whether the provider is back; let another one try."""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            reopen = self._trial
+            self._trial = False
+            if reopen or (self._opened_at is None and self._consecutive >= self.failures):
+                self._opened_at = time.monotonic()
+                tripped = True
+            else:
+                tripped = False
+        if tripped:
+            _count("breaker_trips")
+            logger.warning("OAuth circuit for %s opened after %d failures", self.name, self._consecutive)
+
+
+BREAKERS = {
+    "google": CircuitBreaker("google"),
+    "microsoft": CircuitBreaker("microsoft"),
+}
+CALLBACK_BULKHEAD = node_sync.NodeSemaphore("oauth_callback", CALLBACK_CONCURRENCY)
+
+
+@contextmanager
+def provider_call(provider):
+    """Guard a block of outbound calls to `provider` with its circuit breaker.
+
+    Network errors inside the block count against the breaker and come out as
+    ProviderUnavailable, which the app turns into a 503. Anything else is
+    re-raised as is.
+    """
+    import requests
+
+    breaker = BREAKERS[provider]
+    if not breaker.allow():
+        _count("breaker_rejections")
+        raise ProviderUnavailable(f"{provider} sign-in is temporarily unavailable")
+    try:
+        yield
+    except requests.RequestException as exc:
+        if isinstance(exc, requests.Timeout):
+            _count("timeouts")
+        _count("failures")
+        breaker.record_failure()
+        logger.warning("OAuth call to %s failed: %s", provider, exc)
+        raise ProviderUnavailable(f"{provider} sign-in is temporarily unavailable") from exc
+    except BaseException:
+        # e.g. an MSAL ValueError or a bad JSON body: not a sign the provider
+        # is down, but a half-open breaker must not wait on this trial forever
+        breaker.release_trial()
+        raise
+    else:
+        breaker.record_success()
+
+
+def provider_request(provider, method, url, **kwargs):
+    """Send one request to `provider`; 5xx answers count against its breaker too."""
+    import requests
+
+    with provider_call(provider):
+        response = get_session().request(method, url, **kwargs)
+        if response.status_code >= 500:
+            raise requests.HTTPError(f"{provider} returned {response.status_code}", response=response)
+    return response
+
+
+@contextmanager
+def callback_slot():
+    """Hold one of the node-wide login callback slots for the duration of the block."""
+    token = CALLBACK_BULKHEAD.acquire()
+    if token is None:
+        _count("bulkhead_rejections")
+        raise ProviderUnavailable("Too many sign-ins in progress")
+    try:
+        yield
+    finally:
+        CALLBACK_BULKHEAD.release(token)
+
+
+def _oauth_metrics():
+    counters = stats()
+    return [
+        (f"bytequest_oauth_{name}_total", {}, counters[name])
+        for name in ("timeouts", "failures", "breaker_trips", "breaker_rejections", "bulkhead_rejections")
+    ]
+
+
+metrics.register_collector(_oauth_metrics)
+
+
+def login_callback(view):
+    """Run a login callback view inside one of the node's callback slots."""
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        with callback_slot():
+            return view(*args, **kwargs)
+    return wrapped
+
+
+def stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    counters["breakers"] = {name: breaker.state for name, breaker in BREAKERS.items()}
+    return counters
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _new_session():
+    import requests
+
+    class TimeoutSession(requests.Session):
+        def request(self, method, url, **kwargs):
+            kwargs.setdefault("timeout", (CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS))
+            with metrics.span("oauth"):
+                return super().request(method, url, **kwargs)
+
+    return TimeoutSession()
+
+
+def get_session():
+    """Keep-alive HTTP session shared by all provider calls in this process."""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            from requests.adapters import HTTPAdapter
+
+            session = _new_session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+
+class DiscoveryCache:
+    """An OpenID discovery document cached with TTL and stale-while-revalidate."""
+
+    def __init__(self, provider, url, ttl=DISCOVERY_TTL_SECONDS, max_stale=DISCOVERY_MAX_STALE_SECONDS):
+        self.provider = provider
+        self.url = url
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._document = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        response = provider_request(self.provider, "GET", self.url)
+        response.raise_for_status()
+        document = response.json()
+        with self._lock:
+            self._document = document
+            self._fetched_at = time.monotonic()
+        return document
+
+    def _refresh_in_background(self):
+        import requests
+
+        try:
+            self._fetch()
+        except (requests.RequestException, ValueError, ProviderUnavailable):
+            pass
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self):
+        with self._lock:
+            document = self._document
+            age = time.monotonic() - self._fetched_at
+            if document is not None and age < self.ttl:
+                return document
+            if document is not None and age < self.ttl + self.max_stale:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+                return document
+        return self._fetch()
+
+
+google_discovery = DiscoveryCache("google", GOOGLE_DISCOVERY_URL)
+
+
+def get_google_provider_cfg():
+    return google_discovery.get()
+
+
+def google_client():
+    """A fresh oauthlib client per login: it holds the user's token once parsed."""
+    from oauthlib.oauth2 import WebApplicationClient
+
+    return WebApplicationClient(GOOGLE_CLIENT_ID)
+
+
+_msal_app = None
+_msal_lock = threading.Lock()
+
+
+def get_msal_app():
+    """One MSAL application per process, so authority metadata is fetched once."""
+    global _msal_app
+    with _msal_lock:
+        if _msal_app is None:
+            import msal
+
+            class DiscardingTokenCache(msal.TokenCache):
+                # The shared app only needs a token once, in the callback; never keep them
+                def add(self, event, now=None):
+                    pass
+
+            # Building the app fetches the authority's metadata
+            with provider_call("microsoft"):
+                _msal_app = msal.ConfidentialClientApplication(
+                    MICROSOFT_CLIENT_ID,
+                    authority=MICROSOFT_AUTHORITY_URL,
+                    client_credential=MICROSOFT_CLIENT_SECRET,
+                    validate_authority=MICROSOFT_VALIDATE_AUTHORITY,
+                    instance_discovery=MICROSOFT_VALIDATE_AUTHORITY,
+                    token_cache=DiscardingTokenCache(),
+                    http_client=get_session(),
+                    timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+                )
+        return _msal_app
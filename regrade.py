@@ -0,0 +1,216 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+import answer_keys
+import codeEvaluator
+import node_sync
+import submission_cache
+from db import get_db
+
+UPSERT_PRACTICE_COMPLETED = (
+    "INSERT INTO user_progress (user_id, unit, practice_completed) VALUES (:user_id, :unit, 1) "
+    "ON CONFLICT (user_id, unit) DO UPDATE SET practice_completed = 1 "
+    "WHERE user_progress.practice_completed = 0"
+)
+
+
+def _unit_number(unit_name):
+    if unit_name and unit_name.startswith("unit"):
+        try:
+            return int(unit_name[len("unit"):])
+        except ValueError:
+            return None
+    return None
+
+
+def grade_batch(jobs, answers):
+    """Grade [(key, unit_name, code), ...] against `answers` by piping them through one runner process.
+
+    Returns {key: result}. If a submission kills the runner (RLIMIT_CPU,
+    RLIMIT_AS) it gets the same error an interactive submission would, and the
+    rest of the batch continues in a fresh process.
+    """
+    results = {}
+    pending = list(jobs)
+    while pending:
+        request = "".join(
+            json.dumps(dict(codeEvaluator.build_payload(answers, unit_name, code), id=idx)) + "\n"
+            for idx, (_, unit_name, code) in enumerate(pending)
+        )
+        proc = subprocess.Popen(
+            [sys.executable, codeEvaluator.RUNNER_PATH, "--worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        timeout = (
+            codeEvaluator.SANDBOX_STARTUP_TIMEOUT_SECONDS
+            + codeEvaluator.EXEC_TIMEOUT_SECONDS * len(pending)
+        )
+        timed_out = False
+        try:
+            output, _ = proc.communicate(request.encode("utf-8"), timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            output, _ = proc.communicate()
+            timed_out = True
+
+        replies = {}
+        for line in output.splitlines():
+            try:
+                reply = json.loads(line)
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                continue
+            if isinstance(reply.get("id"), int) and "result" in reply:
+                replies[reply["id"]] = reply
+
+        # Replies come back in order, so the first gap is the submission that
+        # took the process down. Anything after a recycle request is rerun in
+        # a fresh process too.
+        done = 0
+        while done < len(pending) and done in replies:
+            results[pending[done][0]] = replies[done]["result"]
+            done += 1
+            if replies[done - 1].get("recycle"):
+                break
+        else:
+            if done < len(pending):
+                error = codeEvaluator.TIMEOUT_ERROR if timed_out else codeEvaluator.FAILED_ERROR
+                results[pending[done][0]] = {"error": error}
+                done += 1
+        pending = pending[done:]
+    return results
+
+
+def _split(items, jobs, batch_size):
+    if not items:
+        return []
+    size = max(1, min(batch_size, -(-len(items) // jobs)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def regrade_submissions(unit_name=None, jobs=None, batch_size=50, revoke=False, echo=click.echo):
+    """Re-grade stored submissions against the current answer key.
+
+    Submissions are read page by page, identical code within a page is graded
+    once, and the unique runs are spread over `jobs` runner processes. Each
+    page's results and practice completions are written in one transaction.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    db = get_db()
+    # One snapshot for the whole run, even if the file is edited meanwhile
+    answers = answer_keys.current()
+    version = answers.version
+
+    where = "WHERE status = 'done'"
+    params = {}
+    if unit_name:
+        where += " AND unit_name = :unit_name"
+        params["unit_name"] = unit_name
+    total = db.execute(f"SELECT COUNT(*) FROM submission {where}", params).fetchone()[0]
+    echo(f"Regrading {total} submissions with {jobs} runner processes.")
+
+    counts = {"graded": 0, "runs": 0, "cached": 0, "changed": 0}
+    seen = set()
+    passing = set()
+    last_id = ""
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            rows = db.execute(
+                f"SELECT id, user_id, unit_name, code, result FROM submission {where} "
+                "AND id > :last_id ORDER BY id LIMIT :limit",
+                dict(params, last_id=last_id, limit=batch_size * jobs),
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+
+            keys = [submission_cache.make_key(row["unit_name"], version, row["code"]) for row in rows]
+            results = {}
+            todo = {}
+            for row, key in zip(rows, keys):
+                if key in results or key in todo:
+                    continue
+                cached = submission_cache.get(key)
+                if cached is not None:
+                    results[key] = cached
+                    counts["cached"] += 1
+                else:
+                    todo[key] = (key, row["unit_name"], row["code"])
+
+            batches = _split(list(todo.values()), jobs, batch_size)
+            for batch_results in executor.map(grade_batch, batches, [answers] * len(batches)):
+                for key, result in batch_results.items():
+                    # Usage columns keep describing the original run
+                    result.pop("usage", None)
+                    result["answer_key_version"] = version
+                    results[key] = result
+                    if codeEvaluator.is_cacheable(result):
+                        submission_cache.put(key, result)
+            counts["runs"] += len(todo)
+
+            now = time.time()
+            updates = []
+            completions = []
+            for row, key in zip(rows, keys):
+                result = results[key]
+                encoded = json.dumps(result)
+                if encoded != row["result"]:
+                    counts["changed"] += 1
+                updates.append({"result": encoded, "finished_at": now, "id": row["id"]})
+                unit = _unit_number(row["unit_name"])
+                if unit is None:
+                    continue
+                seen.add((row["user_id"], unit))
+                if result.get("success"):
+                    passing.add((row["user_id"], unit))
+                    completions.append((row["user_id"], unit))
+
+            db.executemany(
+                "UPDATE submission SET result = :result, finished_at = :finished_at WHERE id = :id", updates
+            )
+            db.executemany(
+                UPSERT_PRACTICE_COMPLETED,
+                [{"user_id": user_id, "unit": unit} for user_id, unit in completions],
+            )
+            db.commit()
+            for user_id in {user_id for user_id, _ in completions}:
+                node_sync.LEARNING_STATE_GENERATIONS.bump(user_id)
+
+            counts["graded"] += len(rows)
+            elapsed = time.monotonic() - started
+            echo(
+                f"  {counts['graded']}/{total} graded "
+                f"({counts['graded'] / elapsed:.1f}/s, {counts['runs']} sandbox runs, "
+                f"{counts['cached']} cache hits, {counts['changed']} changed)"
+            )
+
+    revoked = 0
+    if revoke:
+        stale = sorted(seen - passing)
+        for start in range(0, len(stale), 500):
+            cursor = db.executemany(
+                "UPDATE user_progress SET practice_completed = 0 "
+                "WHERE user_id = :user_id AND unit = :unit AND practice_completed = 1",
+                [{"user_id": user_id, "unit": unit} for user_id, unit in stale[start:start + 500]],
+            )
+            revoked += cursor.rowcount
+            db.commit()
+            for user_id in {user_id for user_id, _ in stale[start:start + 500]}:
+                node_sync.LEARNING_STATE_GENERATIONS.bump(user_id)
+
+    elapsed = time.monotonic() - started
+    echo(
+        f"Done: {counts['graded']} submissions in {elapsed:.1f}s, "
+        f"{len(passing)} passing user/unit pairs"
+        + (f", {revoked} completions revoked." if revoke else ".")
+    )
+    return counts
@@ -1,14 +1,44 @@
 import json
+import math
 import os
 import resource
+import signal
 import sys
+import time
 from RestrictedPython import compile_restricted, safe_globals
 
-BASE_DIR = os.path.dirname(__file__)
-ANSWER_PATH = os.path.join(BASE_DIR, "data", "unit_answers.json")
-
 CPU_TIME_SECONDS = 2
 MEMORY_LIMIT_BYTES = 128 * 1024 * 1024
+# Each test case has its own CPU budget ("case_cpu_seconds" in the unit's
+# key); all cases of a job share CPU_TIME_SECONDS.
+
+CASE_TIMEOUT_ERROR = "Your code used too much CPU time."
+USER_CODE_FILENAME = "<user_code>"
+
+
+class CaseTimeout(BaseException):
+    """Raised inside the submitted code when a test case runs out of CPU budget."""
+
+
+def _raise_in_user_code(frame, event, arg):
+    if event == "line" and frame.f_code.co_filename == USER_CODE_FILENAME:
+        raise CaseTimeout()
+    return _raise_in_user_code
+
+
+def _on_case_timeout(signum, frame):
+    # The submitted code can swallow this with a bare except, so the next line
+    # of it that runs (the first line of that except clause) raises again,
+    # from outside the try. A trace function that raises is removed, so keep
+    # firing to put it back for any outer try; RLIMIT_CPU is still the
+    # backstop.
+    signal.setitimer(signal.ITIMER_PROF, 0.05)
+    while frame is not None:
+        if frame.f_code.co_filename == USER_CODE_FILENAME:
+            frame.f_trace = _raise_in_user_code
+        frame = frame.f_back
+    sys.settrace(_raise_in_user_code)
+    raise CaseTimeout()
 
 
 def apply_limits():
@@ -23,6 +53,75 @@ def apply_limits():
         pass
 
 
+def apply_job_limits():
+    """Re-arm the soft limits before each job in a long-lived worker.
+
+    RLIMIT_CPU counts the whole process lifetime, so the soft limit is moved to
+    "CPU used so far + CPU_TIME_SECONDS". Hard limits are left alone so they can
+    be raised again for the next job.
+    """
+    cpu_used = process_cpu_seconds()
+    for limit, soft in (
+        (resource.RLIMIT_CPU, math.ceil(cpu_used + CPU_TIME_SECONDS)),
+        (resource.RLIMIT_AS, MEMORY_LIMIT_BYTES),
+    ):
+        try:
+            _, hard = resource.getrlimit(limit)
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            resource.setrlimit(limit, (soft, hard))
+        except (ValueError, resource.error):
+            pass
+
+
+def process_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def reset_peak_rss():
+    """Start a fresh VmHWM so the next reading is this job's peak (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    # Lifetime peak, in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def evaluate_measured(payload):
+    """evaluate() the payload and add a "usage" entry with what the run cost."""
+    reset_peak_rss()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    result = evaluate(
+        payload.get("unit_name"),
+        payload.get("code", ""),
+        payload.get("key"),
+        payload.get("stop_on_first_failure"),
+    )
+    wall = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    result["usage"] = {
+        "cpu_user_seconds": round(after.ru_utime - before.ru_utime, 6),
+        "cpu_system_seconds": round(after.ru_stime - before.ru_stime, 6),
+        "wall_seconds": round(wall, 6),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+    return result
+
+
 def load_payload():
     raw = sys.stdin.read()
     if not raw:
@@ -33,65 +132,174 @@ def load_payload():
         return None
 
 
-def evaluate(unit_name, code, answer_keys):
-    unit_data = answer_keys.get(unit_name)
-    if not unit_data:
-        return {"error": f"Unit {unit_name} not found"}
+def run_case(byte_code, inputs, cpu_budget):
+    """Execute compiled code once with inputs bound as globals.
 
-    expected_answers = unit_data["answers"]
+    Returns (captured_answers, error, limit_exceeded).
+    """
     captured_answers = []
 
     def submit_answers(ans1, ans2, ans3):
         captured_answers.extend([ans1, ans2, ans3])
 
-    try:
-        byte_code = compile_restricted(code, "<user_code>", "exec")
-    except Exception as exc:
-        return {"error": f"Code compilation error: {str(exc)}"}
-
     restricted_globals = safe_globals.copy()
+    restricted_globals.update(inputs)
     restricted_globals["submit_answers"] = submit_answers
     restricted_locals = {}
 
+    previous_handler = signal.signal(signal.SIGPROF, _on_case_timeout)
+    previous_trace = sys.gettrace()
     try:
-        exec(byte_code, restricted_globals, restricted_locals)
+        try:
+            signal.setitimer(signal.ITIMER_PROF, cpu_budget)
+            exec(byte_code, restricted_globals, restricted_locals)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+    except CaseTimeout:
+        return captured_answers, CASE_TIMEOUT_ERROR, False
+    except (MemoryError, RecursionError) as exc:
+        # Reported like any other runtime error, but flagged so a pooled
+        # worker gets recycled instead of running the next job in a bad state.
+        return captured_answers, f"Error running your code: {str(exc)}", True
     except Exception as exc:
-        return {"error": f"Error running your code: {str(exc)}"}
+        return captured_answers, f"Error running your code: {str(exc)}", False
+    finally:
+        # The handler re-arms the timer before raising, so it can still be
+        # pending if the inner finally was cut short. Disarm it before the
+        # previous (usually default, i.e. fatal) SIGPROF action comes back.
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous_handler)
+        sys.settrace(previous_trace)
 
     if not captured_answers:
-        return {"error": "You didn't call submitAnswers() with 3 arguments"}
-
-    if captured_answers == expected_answers:
-        return {
-            "success": True,
-            "score": unit_data["points"],
-            "message": "All correct!",
-        }
-
-    return {
-        "success": False,
-        "score": 0,
-        "expected": expected_answers,
-        "got": captured_answers,
-        "message": "Some answers are incorrect",
-    }
+        return captured_answers, "You didn't call submitAnswers() with 3 arguments", False
+    return captured_answers, None, False
+
+
+def evaluate(unit_name, code, unit_key, stop_on_first_failure=None):
+    """Grade code against a unit's compact key (see answer_keys.compile_unit)."""
+    if not unit_key:
+        return {"error": f"Unit {unit_name} not found"}
+
+    cases = unit_key["cases"]
+    if stop_on_first_failure is None:
+        stop_on_first_failure = unit_key["stop_on_first_failure"]
+    case_budget = unit_key["case_cpu_seconds"]
+
+    # Compile once, run once per case.
+    try:
+        byte_code = compile_restricted(code, USER_CODE_FILENAME, "exec")
+    except Exception as exc:
+        return {"error": f"Code compilation error: {str(exc)}"}
+
+    started = process_cpu_seconds()
+    case_results = []
+    limit_exceeded = False
+    for number, case in enumerate(cases, start=1):
+        remaining = CPU_TIME_SECONDS - (process_cpu_seconds() - started)
+        if remaining <= 0:
+            got, error = [], CASE_TIMEOUT_ERROR
+        else:
+            got, error, limit_exceeded = run_case(
+                byte_code, case["inputs"], min(case_budget, remaining)
+            )
+        case_results.append({
+            "case": number,
+            "passed": error is None and got == case["answers"],
+            "expected": case["answers"],
+            "got": got,
+            "error": error,
+        })
+        if limit_exceeded or (stop_on_first_failure and not case_results[-1]["passed"]):
+            break
+
+    if len(cases) == 1:
+        # Single-case units keep the original result shape.
+        only = case_results[0]
+        if only["error"]:
+            result = {"error": only["error"]}
+        elif only["passed"]:
+            result = {"success": True, "score": unit_key["points"], "message": "All correct!"}
+        else:
+            result = {
+                "success": False,
+                "score": 0,
+                "expected": only["expected"],
+                "got": only["got"],
+                "message": "Some answers are incorrect",
+            }
+        if limit_exceeded:
+            result["limit_exceeded"] = True
+        return result
+
+    passed = sum(1 for case in case_results if case["passed"])
+    result = {"cases": case_results}
+    if passed == len(cases):
+        result.update(success=True, score=unit_key["points"], message="All correct!")
+    else:
+        failed = next(case for case in case_results if not case["passed"])
+        result.update(
+            success=False,
+            score=0,
+            expected=failed["expected"],
+            got=failed["got"],
+            message=f"Passed {passed} of {len(cases)} test cases; case {failed['case']} "
+            + (f"failed: {failed['error']}" if failed["error"] else "gave incorrect answers"),
+        )
+    if limit_exceeded:
+        result["limit_exceeded"] = True
+    return result
+
+
+def serve():
+    """Worker mode: answer one JSON request per stdin line until EOF.
+
+    The first line written is {"ready": true} once imports are done. Each
+    request carries the unit's compact key, so the runner never reads the
+    answer key file. Every reply is {"result": ..., "recycle": bool}, and the
+    result includes the job's CPU time, wall time and peak RSS as "usage";
+    "recycle" asks the pool to replace this process after a limit violation.
+    An "id" in a request is echoed in its reply, so callers can also pipeline
+    a whole batch of requests through one process.
+    """
+    # Keep a private handle on the real stdout for the protocol so nothing the
+    # submitted code manages to write can corrupt it.
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    sys.stdout = sys.stderr
+
+    def reply(message):
+        channel.write(json.dumps(message) + "\n")
+        channel.flush()
+
+    reply({"ready": True})
+    for line in sys.stdin:
+        try:
+            payload = json.loads(line)
+        except json.JSONDecodeError:
+            payload = None
+        if not payload:
+            reply({"result": {"error": "Invalid request payload"}, "recycle": False})
+            continue
+
+        apply_job_limits()
+        result = evaluate_measured(payload)
+        recycle = result.pop("limit_exceeded", False)
+        reply({"id": payload.get("id"), "result": result, "recycle": recycle})
+    return 0
 
 
 def main():
+    if "--worker" in sys.argv[1:]:
+        return serve()
+
     payload = load_payload()
     if not payload:
         print(json.dumps({"error": "Invalid request payload"}))
         return 1
 
-    try:
-        with open(ANSWER_PATH, "r") as handle:
-            answer_keys = json.load(handle)
-    except OSError:
-        print(json.dumps({"error": "Answer key unavailable"}))
-        return 1
-
     apply_limits()
-    result = evaluate(payload.get("unit_name"), payload.get("code", ""), answer_keys)
+    result = evaluate_measured(payload)
+    result.pop("limit_exceeded", None)
     print(json.dumps(result))
     return 0
 
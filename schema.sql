@@ -5,6 +5,7 @@ CREATE TABLE user (
   profile_pic TEXT NOT NULL
 );
 
+-- lessons_read is the pre-lesson_read JSON list, kept only for migration.
 CREATE TABLE user_progress (
   user_id TEXT NOT NULL,
   unit INTEGER NOT NULL,
@@ -13,3 +14,92 @@ CREATE TABLE user_progress (
   PRIMARY KEY (user_id, unit),
   FOREIGN KEY (user_id) REFERENCES user (id)
 );
+
+CREATE TABLE submission (
+  id TEXT PRIMARY KEY,
+  user_id TEXT NOT NULL,
+  unit_name TEXT NOT NULL,
+  code TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'queued',
+  result TEXT,
+  created_at REAL NOT NULL,
+  finished_at REAL,
+  cpu_user_seconds REAL,
+  cpu_system_seconds REAL,
+  wall_seconds REAL,
+  peak_rss_bytes INTEGER,
+  FOREIGN KEY (user_id) REFERENCES user (id)
+);
+
+CREATE INDEX submission_user ON submission (user_id, created_at);
+
+CREATE TABLE lesson_read (
+  user_id TEXT NOT NULL,
+  unit INTEGER NOT NULL,
+  slug TEXT NOT NULL,
+  read_at REAL NOT NULL,
+  PRIMARY KEY (user_id, unit, slug),
+  FOREIGN KEY (user_id) REFERENCES user (id)
+) WITHOUT ROWID;
+
+-- BEGIN class progress summary, kept up to date by triggers (see analytics.py).
+-- app.ensure_progress_schema also adds this block to older databases, so it
+-- has to stay safe to rerun.
+CREATE TABLE IF NOT EXISTS unit_lesson_summary (
+  unit INTEGER NOT NULL,
+  lessons_read INTEGER NOT NULL,
+  students INTEGER NOT NULL,
+  PRIMARY KEY (unit, lessons_read)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS unit_practice_summary (
+  unit INTEGER PRIMARY KEY,
+  students INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS lesson_read_summary_insert AFTER INSERT ON lesson_read
+BEGIN
+  UPDATE unit_lesson_summary SET students = students - 1
+  WHERE unit = NEW.unit AND lessons_read =
+    (SELECT COUNT(*) FROM lesson_read WHERE user_id = NEW.user_id AND unit = NEW.unit) - 1;
+  INSERT INTO unit_lesson_summary (unit, lessons_read, students)
+  VALUES (NEW.unit, (SELECT COUNT(*) FROM lesson_read WHERE user_id = NEW.user_id AND unit = NEW.unit), 1)
+  ON CONFLICT (unit, lessons_read) DO UPDATE SET students = students + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS lesson_read_summary_delete AFTER DELETE ON lesson_read
+BEGIN
+  UPDATE unit_lesson_summary SET students = students - 1
+  WHERE unit = OLD.unit AND lessons_read =
+    (SELECT COUNT(*) FROM lesson_read WHERE user_id = OLD.user_id AND unit = OLD.unit) + 1;
+  INSERT INTO unit_lesson_summary (unit, lessons_read, students)
+  SELECT OLD.unit, remaining, 1
+  FROM (SELECT COUNT(*) AS remaining FROM lesson_read WHERE user_id = OLD.user_id AND unit = OLD.unit)
+  WHERE remaining > 0
+  ON CONFLICT (unit, lessons_read) DO UPDATE SET students = students + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_progress_summary_insert AFTER INSERT ON user_progress
+WHEN NEW.practice_completed
+BEGIN
+  INSERT INTO unit_practice_summary (unit, students) VALUES (NEW.unit, 1)
+  ON CONFLICT (unit) DO UPDATE SET students = students + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_progress_summary_update AFTER UPDATE OF practice_completed ON user_progress
+WHEN (NEW.practice_completed != 0) != (OLD.practice_completed != 0)
+BEGIN
+  INSERT INTO unit_practice_summary (unit, students)
+  VALUES (NEW.unit, CASE WHEN NEW.practice_completed THEN 1 ELSE -1 END)
+  ON CONFLICT (unit) DO UPDATE SET students = students + excluded.students;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_progress_summary_delete AFTER DELETE ON user_progress
+WHEN OLD.practice_completed
+BEGIN
+  UPDATE unit_practice_summary SET students = students - 1 WHERE unit = OLD.unit;
+END;
+
+-- END class progress summary
+
+PRAGMA user_version = 3;
@@ -0,0 +1,108 @@
+-- PostgreSQL version of schema.sql. Safe to run again on an existing
+-- database: `flask init-db` and app startup both apply it.
+CREATE TABLE IF NOT EXISTS "user" (
+  id TEXT PRIMARY KEY,
+  name TEXT NOT NULL,
+  email TEXT UNIQUE NOT NULL,
+  profile_pic TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS user_progress (
+  user_id TEXT NOT NULL REFERENCES "user" (id),
+  unit INTEGER NOT NULL,
+  practice_completed INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, unit)
+);
+
+CREATE TABLE IF NOT EXISTS submission (
+  id TEXT PRIMARY KEY,
+  user_id TEXT NOT NULL REFERENCES "user" (id),
+  unit_name TEXT NOT NULL,
+  code TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'queued',
+  result TEXT,
+  created_at DOUBLE PRECISION NOT NULL,
+  finished_at DOUBLE PRECISION,
+  cpu_user_seconds DOUBLE PRECISION,
+  cpu_system_seconds DOUBLE PRECISION,
+  wall_seconds DOUBLE PRECISION,
+  peak_rss_bytes BIGINT
+);
+
+CREATE INDEX IF NOT EXISTS submission_user ON submission (user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS lesson_read (
+  user_id TEXT NOT NULL REFERENCES "user" (id),
+  unit INTEGER NOT NULL,
+  slug TEXT NOT NULL,
+  read_at DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (user_id, unit, slug)
+);
+
+-- Class-wide progress summary, kept up to date by triggers (see analytics.py)
+CREATE TABLE IF NOT EXISTS unit_lesson_summary (
+  unit INTEGER NOT NULL,
+  lessons_read INTEGER NOT NULL,
+  students INTEGER NOT NULL,
+  PRIMARY KEY (unit, lessons_read)
+);
+
+CREATE TABLE IF NOT EXISTS unit_practice_summary (
+  unit INTEGER PRIMARY KEY,
+  students INTEGER NOT NULL
+);
+
+-- Moves the student from the bucket for their old lesson count to the one
+-- for their new count. Writers to the same user and unit are serialised with
+-- an advisory lock, so each one counts the rows the previous one committed.
+CREATE OR REPLACE FUNCTION lesson_read_summary() RETURNS trigger AS $$
+DECLARE
+  changed lesson_read;
+  remaining INTEGER;
+  previous INTEGER;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    changed := NEW;
+  ELSE
+    changed := OLD;
+  END IF;
+  PERFORM pg_advisory_xact_lock(hashtext(changed.user_id), changed.unit);
+  SELECT COUNT(*) INTO remaining FROM lesson_read WHERE user_id = changed.user_id AND unit = changed.unit;
+  previous := remaining + CASE WHEN TG_OP = 'INSERT' THEN -1 ELSE 1 END;
+
+  UPDATE unit_lesson_summary SET students = students - 1
+  WHERE unit = changed.unit AND lessons_read = previous;
+  IF remaining > 0 THEN
+    INSERT INTO unit_lesson_summary (unit, lessons_read, students) VALUES (changed.unit, remaining, 1)
+    ON CONFLICT (unit, lessons_read) DO UPDATE SET students = unit_lesson_summary.students + 1;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_progress_summary() RETURNS trigger AS $$
+DECLARE
+  delta INTEGER := 0;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.practice_completed != 0 THEN
+    delta := delta - 1;
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.practice_completed != 0 THEN
+    delta := delta + 1;
+  END IF;
+  IF delta != 0 THEN
+    INSERT INTO unit_practice_summary (unit, students)
+    VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.unit ELSE NEW.unit END, delta)
+    ON CONFLICT (unit) DO UPDATE SET students = unit_practice_summary.students + excluded.students;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS lesson_read_summary ON lesson_read;
+CREATE TRIGGER lesson_read_summary AFTER INSERT OR DELETE ON lesson_read
+FOR EACH ROW EXECUTE FUNCTION lesson_read_summary();
+
+DROP TRIGGER IF EXISTS user_progress_summary ON user_progress;
+CREATE TRIGGER user_progress_summary AFTER INSERT OR UPDATE OF practice_completed OR DELETE ON user_progress
+FOR EACH ROW EXECUTE FUNCTION user_progress_summary();
@@ -0,0 +1,170 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:  # in requirements.txt; build-assets refuses to run without it
+    brotli = None
+
+# Fingerprinted copies live under static/build/, next to the originals, so
+# the normal static route can serve them.
+BUILD_DIR = "build"
+MANIFEST_NAME = "manifest.json"
+
+# Only text formats are worth precompressing; images are already compressed.
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def manifest_path(static_folder):
+    return os.path.join(static_folder, BUILD_DIR, MANIFEST_NAME)
+
+
+def fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def is_compressible(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or ""
+    return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def _write_variant(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(static_folder, echo=None):
+    """Copy every static file to a content-hashed name and write the manifest.
+
+    Returns the manifest. Text files also get .gz (and .br, if brotli is
+    installed) siblings when compressing actually makes them smaller.
+    """
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    files = {}
+    for root, dirs, names in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder) and BUILD_DIR in dirs:
+            dirs.remove(BUILD_DIR)
+        for name in sorted(names):
+            source = os.path.join(root, name)
+            rel = os.path.relpath(source, static_folder).replace(os.sep, "/")
+            stem, ext = os.path.splitext(rel)
+            hashed = f"{BUILD_DIR}/{stem}.{fingerprint(source)}{ext}"
+            target = os.path.join(static_folder, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not os.path.exists(target):
+                shutil.copyfile(source, target)
+
+            entry = {"path": hashed, "size": os.path.getsize(source), "encodings": {}}
+            if is_compressible(name):
+                with open(source, "rb") as f:
+                    data = f.read()
+                variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+                if brotli is not None:
+                    variants["br"] = brotli.compress(data, quality=11)
+                for encoding, suffix in ENCODINGS:
+                    compressed = variants.get(encoding)
+                    if compressed is not None and len(compressed) < len(data):
+                        _write_variant(target + suffix, compressed)
+                        entry["encodings"][encoding] = len(compressed)
+            files[rel] = entry
+            if echo:
+                sizes = ", ".join(f"{enc} {size}" for enc, size in entry["encodings"].items())
+                echo(f"{rel} -> {hashed} ({entry['size']} bytes{', ' + sizes if sizes else ''})")
+
+    manifest = {"files": files}
+    os.makedirs(build_root, exist_ok=True)
+    _write_variant(manifest_path(static_folder), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(manifest_path(static_folder), encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+@click.command("build-assets")
+@click.option("--gzip-only", is_flag=True, help="Build without brotli variants if the brotli package is missing.")
+@with_appcontext
+def build_assets_command(gzip_only):
+    """Fingerprint and precompress static files (run before starting workers)."""
+    if brotli is None and not gzip_only:
+        raise click.ClickException(
+            "The brotli package isn't installed, so no .br variants would be built. "
+            "Run `pip install -r requirements.txt`, or pass --gzip-only to build without them."
+        )
+    manifest = build(current_app.static_folder, echo=click.echo)
+    click.echo(f"Wrote {len(manifest['files'])} assets to {manifest_path(current_app.static_folder)}")
+
+
+def init_app(app):
+    """Serve fingerprinted assets if a manifest has been built.
+
+    url_for('static', filename=...) then points at the hashed copy, which is
+    served with an immutable Cache-Control and, when the client accepts it, a
+    precompressed variant. Without a manifest, url_for works as before.
+    """
+    app.cli.add_command(build_assets_command)
+
+    files = load_manifest(app.static_folder)
+    app.extensions["static_assets"] = files
+    hashed = {entry["path"]: entry for entry in files.values()}
+
+    if files:
+        @app.url_defaults
+        def fingerprint_static_urls(endpoint, values):
+            if endpoint == "static":
+                entry = files.get(values.get("filename"))
+                if entry is not None:
+                    values["filename"] = entry["path"]
+
+    send_static_file = app.view_functions["static"]
+
+    def static(filename):
+        # Everything under build/ has its content hash in the name (this also
+        # covers the image variants from image_assets)
+        if not filename.startswith(BUILD_DIR + "/") or filename.endswith(".json"):
+            return send_static_file(filename=filename)
+        entry = hashed.get(filename, {"encodings": {}})
+
+        mimetype = mimetypes.guess_type(filename)[0]
+        response = None
+        for encoding, suffix in ENCODINGS:
+            if encoding in entry["encodings"] and request.accept_encodings[encoding]:
+                response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype)
+                response.headers["Content-Encoding"] = encoding
+                break
+        if response is None:
+            response = send_from_directory(app.static_folder, filename, mimetype=mimetype)
+        if entry["encodings"]:
+            response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    app.view_functions["static"] = static
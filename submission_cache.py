@@ -0,0 +1,138 @@
+import ast
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import metrics
+
+BASE_DIR = os.path.dirname(__file__)
+
+# Results of graded submissions, keyed on (unit, answer key version, code).
+# Each web worker keeps a small LRU in memory; the directory below is shared by
+# every worker on the node. Set SUBMISSION_CACHE_DIR to "" to turn the disk
+# store off and SUBMISSION_CACHE_SIZE to 0 to turn the memory LRU off.
+CACHE_DIR = os.getenv(
+    "SUBMISSION_CACHE_DIR", os.path.join(BASE_DIR, "instance", "submission_cache")
+)
+CACHE_SIZE = int(os.getenv("SUBMISSION_CACHE_SIZE", "1024"))
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+
+def canonical_code_hash(code):
+    """Hash the code's AST so whitespace and comment edits map to the same key."""
+    try:
+        canonical = ast.dump(ast.parse(code), include_attributes=False)
+    except (SyntaxError, ValueError):
+        canonical = code
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def make_key(unit_name, answer_key_version, code):
+    return "{}-{}-{}".format(
+        unit_name or "", answer_key_version[:16], canonical_code_hash(code or "")
+    )
+
+
+def _disk_path(key):
+    version = key.split("-")[-2]
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, version, digest[:2], digest + ".json")
+
+
+def drop_version(answer_key_version):
+    """Drop on-disk entries for an answer key that has been replaced.
+
+    Called by the worker that reloads away from that version, so a worker
+    still on an older key never removes the entries for a newer one.
+    """
+    if CACHE_DIR:
+        shutil.rmtree(os.path.join(CACHE_DIR, answer_key_version[:16]), ignore_errors=True)
+
+
+def _remember(key, raw):
+    if CACHE_SIZE <= 0:
+        return
+    _memory[key] = raw
+    _memory.move_to_end(key)
+    while len(_memory) > CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+def get(key):
+    """Return a cached result dict for key, or None."""
+    with _lock:
+        raw = _memory.get(key)
+        if raw is not None:
+            _memory.move_to_end(key)
+            _counters["memory_hits"] += 1
+            return json.loads(raw)
+
+    if CACHE_DIR:
+        try:
+            with open(_disk_path(key), "r") as handle:
+                raw = handle.read()
+            result = json.loads(raw)
+        except (OSError, json.JSONDecodeError):
+            pass
+        else:
+            with _lock:
+                _remember(key, raw)
+                _counters["disk_hits"] += 1
+            return result
+
+    with _lock:
+        _counters["misses"] += 1
+    return None
+
+
+def put(key, result):
+    raw = json.dumps(result)
+    with _lock:
+        _remember(key, raw)
+        _counters["stores"] += 1
+
+    if not CACHE_DIR:
+        return
+    path = _disk_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so other workers never read a half-written file.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as handle:
+            handle.write(raw)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def stats():
+    """Hit/miss counters for this process."""
+    with _lock:
+        counters = dict(_counters)
+        counters["memory_entries"] = len(_memory)
+    return counters
+
+
+def cache_metrics():
+    counters = stats()
+    return [
+        (f"bytequest_submission_cache_{name}_total", {}, counters[name])
+        for name in ("memory_hits", "disk_hits", "misses", "stores")
+    ]
+
+
+metrics.register_collector(cache_metrics)
+
+
+def clear():
+    with _lock:
+        _memory.clear()
+    if CACHE_DIR:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
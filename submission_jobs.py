@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import codeEvaluator
+import metrics
+import node_sync
+import submission_cache
+from db import close_db, get_db
+
+# Opt-in async grading (ASYNC_SUBMISSIONS in the app config). Jobs are stored
+# in the `submission` table so any worker can answer a status request; the
+# sandbox run itself happens on a small thread pool in the worker that took
+# the POST, off the request thread.
+JOB_WORKERS = int(os.getenv("SUBMISSION_JOB_WORKERS", "4"))
+# A queued/running job older than this was lost with its worker process.
+JOB_STALE_SECONDS = float(os.getenv("SUBMISSION_JOB_STALE_SECONDS", "120"))
+POLL_INTERVAL_SECONDS = 0.25
+
+LOST_ERROR = "Your submission was lost, please submit it again."
+
+# How many submissions one user may have being graded at once, across every
+# worker on the node (0 means no limit).
+MAX_INFLIGHT_PER_USER = int(os.getenv("SUBMISSION_MAX_INFLIGHT_PER_USER", "1"))
+# Users are hashed into this many groups of slots, so the lock files stay a
+# fixed set however many users submit. Users sharing a group share its slots.
+INFLIGHT_BUCKETS = int(os.getenv("SUBMISSION_INFLIGHT_BUCKETS", "1024"))
+INFLIGHT_ERROR = "You already have a submission being graded. Wait for its result, then try again."
+
+# Identical (user, unit, code) submissions that arrive while one is being
+# graded wait for it and get its result instead of starting another run.
+FLIGHTS = node_sync.SingleFlight("submission_flights")
+FLIGHT_WAIT_SECONDS = (
+    codeEvaluator.SANDBOX_QUEUE_TIMEOUT_SECONDS + codeEvaluator.EXEC_TIMEOUT_SECONDS + 5
+)
+
+# Sandbox resource usage stored with each graded submission (NULL for results
+# that came from the submission cache).
+USAGE_COLUMNS = (
+    ("cpu_user_seconds", "REAL"),
+    ("cpu_system_seconds", "REAL"),
+    ("wall_seconds", "REAL"),
+    ("peak_rss_bytes", "INTEGER"),
+)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+# Completion events for jobs running in this process, so long-polls here
+# wake up immediately instead of on the next DB poll.
+_done_events = {}
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=JOB_WORKERS, thread_name_prefix="submission-job"
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def claim_user_slot(user_id):
+    """Take one of the user's in-flight submission slots.
+
+    Returns a callable that gives it back, or None if the user already has
+    MAX_INFLIGHT_PER_USER submissions being graded (or, rarely, another user
+    hashed into the same bucket holds them).
+    """
+    if MAX_INFLIGHT_PER_USER <= 0:
+        return lambda: None
+    digest = hashlib.sha1(str(user_id).encode("utf-8")).digest()
+    bucket = int.from_bytes(digest[:8], "big") % INFLIGHT_BUCKETS
+    slots = node_sync.NodeSemaphore(f"inflight/{bucket}", MAX_INFLIGHT_PER_USER)
+    token = slots.acquire()
+    if token is None:
+        metrics.increment("bytequest_submission_inflight_rejections_total")
+        return None
+    return lambda: slots.release(token)
+
+
+def flight_key(user_id, unit_name, code):
+    return f"{user_id}:{unit_name}:{submission_cache.canonical_code_hash(code or '')}"
+
+
+def single_flight(user_id, unit_name, code, grade):
+    """Run grade() unless the same submission is already being graded, then share its result."""
+    result, shared = FLIGHTS.run(flight_key(user_id, unit_name, code), grade, FLIGHT_WAIT_SECONDS)
+    if shared:
+        metrics.increment("bytequest_submission_coalesced_total")
+    return result
+
+
+def find_inflight_job(user_id, unit_name, code):
+    """Id of this user's queued or running job for exactly this code, if any."""
+    row = get_db().execute(
+        "SELECT id FROM submission WHERE user_id = :user_id AND created_at > :since AND unit_name = :unit_name "
+        "AND code = :code AND status IN ('queued', 'running') ORDER BY created_at DESC LIMIT 1",
+        {"user_id": user_id, "since": time.time() - JOB_STALE_SECONDS, "unit_name": unit_name, "code": code},
+    ).fetchone()
+    return row["id"] if row else None
+
+
+def enqueue(app, user_id, unit_name, code, on_success=None, release=None):
+    """Store a queued job, start grading it in the background and return its id.
+
+    on_success(user_id) runs inside an app context on the job thread when the
+    submission passes; release() runs once the job has finished either way.
+    """
+    job_id = uuid.uuid4().hex
+    db = get_db()
+    db.execute(
+        "INSERT INTO submission (id, user_id, unit_name, code, status, created_at) "
+        "VALUES (:id, :user_id, :unit_name, :code, 'queued', :created_at)",
+        {"id": job_id, "user_id": user_id, "unit_name": unit_name, "code": code, "created_at": time.time()},
+    )
+    db.commit()
+    _done_events[job_id] = threading.Event()
+    _get_executor().submit(_run_job, app, job_id, user_id, unit_name, code, on_success, release)
+    return job_id
+
+
+def split_usage(result):
+    """Return (result JSON without "usage", {usage column: value}) for storing a result."""
+    usage = result.get("usage") or {}
+    stored = {key: value for key, value in result.items() if key != "usage"}
+    return json.dumps(stored), {column: usage.get(column) for column, _ in USAGE_COLUMNS}
+
+
+def record_submission(user_id, unit_name, code, result):
+    """Store a submission that was graded synchronously, so it can be regraded later."""
+    now = time.time()
+    encoded, usage = split_usage(result)
+    db = get_db()
+    db.execute(
+        "INSERT INTO submission (id, user_id, unit_name, code, status, result, created_at, finished_at, "
+        "cpu_user_seconds, cpu_system_seconds, wall_seconds, peak_rss_bytes) "
+        "VALUES (:id, :user_id, :unit_name, :code, 'done', :result, :created_at, :finished_at, "
+        ":cpu_user_seconds, :cpu_system_seconds, :wall_seconds, :peak_rss_bytes)",
+        dict(
+            usage, id=uuid.uuid4().hex, user_id=user_id, unit_name=unit_name, code=code,
+            result=encoded, created_at=now, finished_at=now,
+        ),
+    )
+    db.commit()
+
+
+def _run_job(app, job_id, user_id, unit_name, code, on_success, release=None):
+    with app.app_context():
+        try:
+            db = get_db()
+            db.execute("UPDATE submission SET status = 'running' WHERE id = :id", {"id": job_id})
+            db.commit()
+            close_db()
+            try:
+                result = codeEvaluator.evaluate_submission(unit_name, code)
+            except Exception:
+                app.logger.exception("Submission job %s failed", job_id)
+                result = {"error": codeEvaluator.FAILED_ERROR}
+            if result.get("success") and on_success is not None:
+                on_success(user_id)
+            encoded, usage = split_usage(result)
+            db = get_db()
+            db.execute(
+                "UPDATE submission SET status = 'done', result = :result, finished_at = :finished_at, "
+                "cpu_user_seconds = :cpu_user_seconds, cpu_system_seconds = :cpu_system_seconds, "
+                "wall_seconds = :wall_seconds, peak_rss_bytes = :peak_rss_bytes "
+                "WHERE id = :id",
+                dict(usage, result=encoded, finished_at=time.time(), id=job_id),
+            )
+            db.commit()
+        except Exception:
+            app.logger.exception("Could not record submission job %s", job_id)
+        finally:
+            if release is not None:
+                release()
+            event = _done_events.pop(job_id, None)
+            if event is not None:
+                event.set()
+
+
+def get_job(job_id, user_id):
+    """Return the job as a dict, or None if it doesn't exist for this user."""
+    row = get_db().execute(
+        "SELECT id, unit_name, code, status, result, created_at FROM submission "
+        "WHERE id = :id AND user_id = :user_id",
+        {"id": job_id, "user_id": user_id},
+    ).fetchone()
+    if not row:
+        return None
+    job = {
+        "id": row["id"],
+        "unit_name": row["unit_name"],
+        "code": row["code"],
+        "status": row["status"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+    }
+    if job["status"] != "done" and time.time() - row["created_at"] > JOB_STALE_SECONDS:
+        job["status"] = "done"
+        job["result"] = {"error": LOST_ERROR}
+    return job
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[max(1, -(-len(sorted_values) * pct // 100)) - 1]
+
+
+def usage_by_unit(unit_name=None, since=None):
+    """Per-unit distribution of sandbox usage over stored submissions.
+
+    Returns {unit_name: {column: {"count", "p50", "p95", "p99", "max"}}}.
+    Cached results have no usage and are left out.
+    """
+    where = "WHERE wall_seconds IS NOT NULL"
+    params = {}
+    if unit_name:
+        where += " AND unit_name = :unit_name"
+        params["unit_name"] = unit_name
+    if since is not None:
+        where += " AND created_at >= :since"
+        params["since"] = since
+    values = {}
+    rows = get_db().execute(
+        "SELECT unit_name, cpu_user_seconds + cpu_system_seconds AS cpu_seconds, "
+        f"wall_seconds, peak_rss_bytes FROM submission {where}",
+        params,
+    )
+    for row in rows:
+        unit = values.setdefault(row["unit_name"], {"cpu_seconds": [], "wall_seconds": [], "peak_rss_bytes": []})
+        for column in unit:
+            if row[column] is not None:
+                unit[column].append(row[column])
+
+    report = {}
+    for unit, columns in sorted(values.items()):
+        report[unit] = {}
+        for column, numbers in columns.items():
+            numbers.sort()
+            report[unit][column] = {
+                "count": len(numbers),
+                "p50": _percentile(numbers, 50),
+                "p95": _percentile(numbers, 95),
+                "p99": _percentile(numbers, 99),
+                "max": numbers[-1] if numbers else None,
+            }
+    return report
+
+
+def wait_for_job(job_id, user_id, timeout):
+    """Long-poll: return the job once it is done or timeout seconds have passed."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = get_job(job_id, user_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job["status"] == "done" or remaining <= 0:
+            return job
+        # Don't hold a pooled connection while waiting
+        close_db()
+        event = _done_events.get(job_id)
+        if event is not None:
+            event.wait(min(remaining, 1.0))
+        else:
+            time.sleep(min(remaining, POLL_INTERVAL_SECONDS))
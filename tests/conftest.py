@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+# Read when the app's modules are imported, so they have to be set first
+_workdir = tempfile.mkdtemp(prefix="bytequest-tests-")
+os.environ.setdefault("BYTEQUEST_RUN_DIR", os.path.join(_workdir, "run"))
+os.environ.setdefault("BYTEQUEST_DATABASE", os.path.join(_workdir, "app.sqlite"))
+os.environ["SUBMISSION_CACHE_DIR"] = ""
+os.environ["JINJA_BYTECODE_CACHE_DIR"] = ""
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The app on a fresh SQLite database created from schema.sql."""
+    import app as app_module
+
+    database = str(tmp_path / "app.sqlite")
+    db = sqlite3.connect(database)
+    with open(os.path.join(BASE_DIR, "schema.sql"), encoding="utf-8") as f:
+        db.executescript(f.read())
+    db.close()
+    return app_module.create_app({"DATABASE": database, "TESTING": True})
@@ -0,0 +1,230 @@
+"""A local stand-in for Google's and Microsoft's sign-in endpoints.
+
+Serves HTTPS on 127.0.0.1 with a throwaway self-signed certificate (MSAL
+refuses plain http authorities):
+
+    /google/.well-known/openid-configuration   Google discovery document
+    /common/v2.0/.well-known/openid-configuration   Microsoft tenant metadata
+    /authorize     "signs in" at once and redirects back with a code
+    /token         trades a code for an access token
+    /userinfo      Google profile for the token
+    /graph/me      Microsoft Graph profile for the token
+
+Run it on its own to try logins in a browser-less dev setup:
+
+    python tests/fake_idp.py
+
+prints the environment variables that point the app at it.
+"""
+import datetime
+import ipaddress
+import json
+import os
+import secrets
+import ssl
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+GOOGLE_PROFILE = {
+    "sub": "fake-google-1",
+    "email": "student@fake-idp.invalid",
+    "email_verified": True,
+    "given_name": "Fake Student",
+    "picture": "static/images/logo.png",
+}
+MICROSOFT_PROFILE = {
+    "id": "fake-microsoft-1",
+    "mail": "teacher@fake-idp.invalid",
+    "displayName": "Fake Teacher",
+}
+
+
+def _self_signed_cert(directory):
+    """Write a certificate/key pair for 127.0.0.1 and return their paths."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "ByteQuest fake IdP")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+        .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(key.public_key()), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "fake_idp.pem")
+    key_path = os.path.join(directory, "fake_idp.key")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ))
+    return cert_path, key_path
+
+
+class FakeIdentityProvider:
+    """The fake server; `requests` lists (method, path) of every call it got."""
+
+    def __init__(self, google_profile=GOOGLE_PROFILE, microsoft_profile=MICROSOFT_PROFILE):
+        self.profiles = {"google": google_profile, "microsoft": microsoft_profile}
+        self.requests = []
+        self._codes = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._directory = tempfile.mkdtemp(prefix="bytequest-fake-idp-")
+        self.cert_path, key_path = _self_signed_cert(self._directory)
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.cert_path, key_path)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self.base_url = f"https://127.0.0.1:{self._server.server_port}"
+        self._thread = None
+
+    @property
+    def google_discovery_url(self):
+        return self.base_url + "/google/.well-known/openid-configuration"
+
+    @property
+    def microsoft_authority_url(self):
+        return self.base_url + "/common"
+
+    @property
+    def microsoft_graph_me_url(self):
+        return self.base_url + "/graph/me"
+
+    def environ(self):
+        """Settings that point oauth_providers at this server."""
+        return {
+            "GOOGLE_DISCOVERY_URL": self.google_discovery_url,
+            "MICROSOFT_AUTHORITY_URL": self.microsoft_authority_url,
+            "MICROSOFT_GRAPH_ME_URL": self.microsoft_graph_me_url,
+            "MICROSOFT_VALIDATE_AUTHORITY": "false",
+            "REQUESTS_CA_BUNDLE": self.cert_path,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _documents(self):
+        return {
+            "/google/.well-known/openid-configuration": {
+                "issuer": self.base_url + "/google",
+                "authorization_endpoint": self.base_url + "/authorize?provider=google",
+                "token_endpoint": self.base_url + "/token",
+                "userinfo_endpoint": self.base_url + "/userinfo",
+            },
+            "/common/v2.0/.well-known/openid-configuration": {
+                "issuer": self.base_url + "/common/v2.0",
+                "authorization_endpoint": self.base_url + "/authorize?provider=microsoft",
+                "token_endpoint": self.base_url + "/token",
+            },
+        }
+
+    def _handler(self):
+        idp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _profile(self, provider):
+                token = self.headers.get("Authorization", "").partition("Bearer ")[2]
+                with idp._lock:
+                    issued_for = idp._tokens.get(token)
+                if issued_for != provider:
+                    return self._send_json(401, {"error": "invalid_token"})
+                self._send_json(200, idp.profiles[provider])
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                with idp._lock:
+                    idp.requests.append(("GET", url.path))
+                documents = idp._documents()
+                if url.path in documents:
+                    return self._send_json(200, documents[url.path])
+                if url.path == "/authorize":
+                    code = secrets.token_urlsafe(16)
+                    with idp._lock:
+                        idp._codes[code] = query.get("provider", "google")
+                    back = {"code": code}
+                    if "state" in query:
+                        back["state"] = query["state"]
+                    self.send_response(302)
+                    self.send_header("Location", query["redirect_uri"] + "?" + urlencode(back))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if url.path == "/userinfo":
+                    return self._profile("google")
+                if url.path == "/graph/me":
+                    return self._profile("microsoft")
+                self._send_json(404, {"error": "not_found"})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+                with idp._lock:
+                    idp.requests.append(("POST", url.path))
+                if url.path != "/token":
+                    return self._send_json(404, {"error": "not_found"})
+                with idp._lock:
+                    provider = idp._codes.pop(form.get("code"), None)
+                if provider is None:
+                    return self._send_json(400, {"error": "invalid_grant"})
+                token = secrets.token_urlsafe(24)
+                with idp._lock:
+                    idp._tokens[token] = provider
+                self._send_json(200, {
+                    "access_token": token,
+                    "token_type": "Bearer",
+                    "expires_in": 3600,
+                    "scope": form.get("scope", "openid email profile"),
+                })
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    idp = FakeIdentityProvider()
+    for name, value in idp.environ().items():
+        print(f"export {name}={value}")
+    print("# Ctrl-C to stop")
+    try:
+        idp._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,44 @@
+"""The class progress summary tables and their triggers."""
+import sqlite3
+
+import analytics
+
+
+def summary_objects(database):
+    db = sqlite3.connect(database)
+    try:
+        return db.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE name LIKE 'unit_%_summary' "
+            "OR name LIKE '%_summary_%' ORDER BY name"
+        ).fetchall()
+    finally:
+        db.close()
+
+
+def test_older_databases_get_the_summary_from_schema_sql(app, tmp_path):
+    import app as app_module
+
+    fresh = summary_objects(app.config["DATABASE"])
+    assert len([kind for kind, _, _ in fresh if kind == "trigger"]) == 5
+
+    # A database from before the summary: progress but no summary tables
+    db = sqlite3.connect(app.config["DATABASE"])
+    for kind, name, _ in fresh:
+        db.execute(f"DROP {kind.upper()} {name}")
+    db.executescript(
+        """
+        INSERT INTO user VALUES ('s1', 'S', 's1@example.invalid', 'p.png');
+        INSERT INTO lesson_read VALUES ('s1', 1, '1a', 0), ('s1', 1, '1b', 0);
+        INSERT INTO user_progress (user_id, unit, practice_completed) VALUES ('s1', 1, 1);
+        PRAGMA user_version = 2;
+        """
+    )
+    db.close()
+
+    with app.app_context():
+        app_module.ensure_progress_schema()
+        summary = {unit["unit"]: unit for unit in analytics.class_summary()}
+    assert summary[1]["started"] == 1
+    assert summary[1]["lesson_reads"] == 2
+    assert summary[1]["practice_completed"] == 1
+    assert summary_objects(app.config["DATABASE"]) == fresh
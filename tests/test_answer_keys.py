@@ -0,0 +1,72 @@
+"""Reloading the answer key while the app is running."""
+import json
+import os
+import types
+from collections import OrderedDict
+
+import pytest
+
+import answer_keys
+import codeEvaluator
+import submission_cache
+
+CODE = "submit_answers(1, 2, 3)"
+
+
+def write_key(path, answers, mtime):
+    path.write_text(json.dumps({"unit1": {"answers": answers, "points": 10}}))
+    os.utime(path, ns=(mtime, mtime))
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    path = tmp_path / "unit_answers.json"
+    write_key(path, [1, 2, 3], 1_000_000_000)
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(answer_keys, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    monkeypatch.setattr(answer_keys, "ANSWER_KEY_CHECK_SECONDS", 5)
+    monkeypatch.setattr(answer_keys, "STORE", answer_keys.AnswerKeyStore(str(path)))
+    monkeypatch.setattr(submission_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(submission_cache, "_memory", OrderedDict())
+    monkeypatch.setattr(codeEvaluator, "SANDBOX_POOL_SIZE", 0)
+
+    dropped = []
+    drop_version = submission_cache.drop_version
+
+    def record_drop(version):
+        dropped.append(version)
+        drop_version(version)
+
+    monkeypatch.setattr(submission_cache, "drop_version", record_drop)
+    return types.SimpleNamespace(path=path, clock=clock, dropped=dropped)
+
+
+def version_dir(version):
+    return os.path.join(submission_cache.CACHE_DIR, version[:16])
+
+
+def test_a_new_answer_key_is_picked_up_and_old_results_are_dropped(store):
+    old = answer_keys.current().version
+    result = codeEvaluator.evaluate_submission("unit1", CODE)
+    assert result["success"] and result["answer_key_version"] == old
+    assert os.path.isdir(version_dir(old))
+
+    write_key(store.path, [4, 5, 6], 2_000_000_000)
+    # Not looked at again until ANSWER_KEY_CHECK_SECONDS have passed
+    assert answer_keys.current().version == old
+
+    store.clock.now += 6
+    new = answer_keys.current().version
+    assert new != old
+    result = codeEvaluator.evaluate_submission("unit1", CODE)
+    assert not result["success"] and result["answer_key_version"] == new
+    assert result["expected"] == [4, 5, 6]
+    assert store.dropped == [old]
+    assert not os.path.exists(version_dir(old))
+    assert os.path.isdir(version_dir(new))
+
+    # Later checks of an unchanged file drop nothing
+    store.clock.now += 6
+    assert answer_keys.current().version == new
+    assert store.dropped == [old]
+    assert os.path.isdir(version_dir(new))
@@ -0,0 +1,78 @@
+"""Incremental unlock updates against a full rebuild, on data/curriculum.json."""
+import copy
+
+import pytest
+
+import curriculum
+
+
+@pytest.fixture
+def course():
+    return curriculum.load()
+
+
+def finished(course, number):
+    return {"lessons_read": sorted(course.unit_index[number]["slugs"]), "practice_completed": True}
+
+
+def apply(progress, number, read_slug=None, practice_completed=False):
+    progress = copy.deepcopy(progress)
+    unit = progress.setdefault(number, {"lessons_read": [], "practice_completed": False})
+    if read_slug is not None:
+        unit["lessons_read"] = sorted(set(unit["lessons_read"]) | {read_slug})
+    unit["practice_completed"] = unit["practice_completed"] or practice_completed
+    return progress
+
+
+def advance_and_rebuild(course, progress, number, **change):
+    """Return (advanced state, rebuilt state, previous state, new progress)."""
+    state = course.evaluate(progress)
+    progress = apply(progress, number, **change)
+    return course.advance(state, number, **change), course.evaluate(progress), state, progress
+
+
+def test_downstream_follows_requires(course):
+    assert course.downstream[4] == (4, 5, 6, 7)
+    assert course.downstream[5] == (5,)
+    assert course.downstream[6] == (6, 7)
+    assert course.downstream[7] == (7,)
+
+
+def test_finishing_unit_4_unlocks_5_and_6(course):
+    progress = {number: finished(course, number) for number in (1, 2, 3)}
+    progress[4] = {"lessons_read": ["4a", "4b"], "practice_completed": False}
+
+    # The last lesson opens unit 4's practice; 5 and 6 wait for it to be passed
+    advanced, rebuilt, before, progress = advance_and_rebuild(course, progress, 4, read_slug="4c")
+    assert advanced == rebuilt
+    assert advanced["units"][4]["practice_unlocked"] and not before["units"][4]["practice_unlocked"]
+    assert not advanced["units"][5]["article_unlocked"]
+    # Units upstream of 4 are shared, not recomputed
+    assert all(advanced["units"][n] is before["units"][n] for n in (1, 2, 3))
+
+    advanced, rebuilt, before, progress = advance_and_rebuild(course, progress, 4, practice_completed=True)
+    assert advanced == rebuilt
+    assert advanced["units"][5]["article_unlocked"] and advanced["units"][6]["article_unlocked"]
+    assert not before["units"][5]["article_unlocked"] and not before["units"][6]["article_unlocked"]
+    assert not advanced["units"][7]["article_unlocked"]
+
+
+def test_finishing_unit_6_practice_unlocks_7(course):
+    progress = {number: finished(course, number) for number in (1, 2, 3, 4)}
+    progress[6] = {"lessons_read": ["6a", "6b"], "practice_completed": False}
+
+    advanced, rebuilt, before, _ = advance_and_rebuild(course, progress, 6, practice_completed=True)
+    assert advanced == rebuilt
+    assert advanced["units"][7]["article_unlocked"] and not before["units"][7]["article_unlocked"]
+    assert advanced["units"][5] is before["units"][5]
+
+
+def test_a_change_that_changes_nothing(course):
+    progress = {number: finished(course, number) for number in (1, 2)}
+    progress[3] = {"lessons_read": ["3a"], "practice_completed": False}
+
+    advanced, rebuilt, before, _ = advance_and_rebuild(course, progress, 3, read_slug="3a")
+    assert advanced == rebuilt == before
+    advanced, rebuilt, before, _ = advance_and_rebuild(course, progress, 1, practice_completed=True)
+    assert advanced == rebuilt == before
+    assert course.advance(before, 99, read_slug="x") is before
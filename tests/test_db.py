@@ -0,0 +1,86 @@
+"""Queries on each database the app supports.
+
+The PostgreSQL runs need a server and its driver; point
+BYTEQUEST_TEST_DATABASE_URL at a database the tests may create and drop
+databases on, e.g. postgresql+psycopg://postgres@localhost/postgres.
+Without it they are skipped.
+"""
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+
+import analytics
+import db as db_module
+import submission_jobs
+from db import get_db
+from user import User
+
+TEST_DATABASE_URL = os.getenv("BYTEQUEST_TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def postgres_url():
+    if not TEST_DATABASE_URL:
+        pytest.skip("BYTEQUEST_TEST_DATABASE_URL is not set")
+    pytest.importorskip("psycopg")
+    server = create_engine(TEST_DATABASE_URL, isolation_level="AUTOCOMMIT")
+    name = f"bytequest_test_{uuid.uuid4().hex[:12]}"
+    with server.connect() as connection:
+        connection.execute(text(f'CREATE DATABASE "{name}"'))
+    yield make_url(TEST_DATABASE_URL).set(database=name).render_as_string(hide_password=False)
+    db_module.dispose_engines()
+    with server.connect() as connection:
+        connection.execute(text(f'DROP DATABASE "{name}"'))
+    server.dispose()
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def any_app(request):
+    if request.param == "sqlite":
+        return request.getfixturevalue("app")
+    import app as app_module
+
+    url = request.getfixturevalue("postgres_url")
+    return app_module.create_app({"SQLALCHEMY_DATABASE_URI": url, "TESTING": True})
+
+
+def test_placeholders_inside_literals_are_left_alone(any_app):
+    with any_app.app_context():
+        row = get_db().execute(
+            "SELECT '?' AS question, '100%' AS percent, '12:30' AS time, :value AS value",
+            {"value": "bound"},
+        ).fetchone()
+        assert tuple(row) == ("?", "100%", "12:30", "bound")
+        assert row["value"] == "bound"
+
+
+def test_progress_and_submissions_round_trip(any_app):
+    import app as app_module
+
+    with any_app.app_context():
+        User.create("db-1", "Student", "student@example.invalid", "p.png")
+        assert User.get("db-1").email == "student@example.invalid"
+        User.update_profile("db-1", "Renamed", "q.png")
+        assert User.get_by_email("student@example.invalid").name == "Renamed"
+
+        app_module.LESSON_READS.add("db-1", 1, "1a")
+        app_module.flush_lesson_reads()
+        app_module.record_practice_completed("db-1", 1)
+        app_module.record_practice_completed("db-1", 1)
+        progress = app_module.get_unit_progress("db-1")
+        assert progress[1]["practice_completed"]
+        assert "1a" in progress[1]["lessons_read"]
+
+        summary = {unit["unit"]: unit for unit in analytics.class_summary()}
+        assert summary[1]["started"] == 1
+        assert summary[1]["practice_completed"] == 1
+
+        result = {"success": True, "usage": {"cpu_user_seconds": 0.5, "cpu_system_seconds": 0.25,
+                                             "wall_seconds": 1.0, "peak_rss_bytes": 1024}}
+        submission_jobs.record_submission("db-1", "unit1", "submit_answers(1)", result)
+        usage = submission_jobs.usage_by_unit("unit1")
+        assert usage["unit1"]["cpu_seconds"]["max"] == 0.75
+        assert submission_jobs.usage_by_unit(since=2 ** 40) == {}
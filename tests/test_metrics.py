@@ -0,0 +1,49 @@
+"""Node-wide totals across worker restarts."""
+import json
+import os
+import re
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    return tmp_path
+
+
+def counter(name):
+    match = re.search(rf"^{name} (\S+)$", metrics.render_prometheus(), re.M)
+    return float(match.group(1)) if match else 0
+
+
+def write_snapshot(directory, name, value):
+    with open(directory / f"{name}.json", "w", encoding="utf-8") as f:
+        json.dump({"histograms": [], "counters": [
+            {"name": "bytequest_test_total", "labels": {}, "value": value},
+            {"name": "bytequest_db_pool_checked_out", "labels": {}, "value": 4},
+        ]}, f)
+
+
+def test_exited_workers_are_folded_and_never_go_backwards(metrics_dir):
+    for expected in (3, 6, 9):
+        pid = os.fork()
+        if pid == 0:
+            metrics.increment("bytequest_test_total", 3)
+            metrics.flush(force=True)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        assert counter("bytequest_test_total") == expected
+    assert sorted(os.listdir(metrics_dir)) == [".lock", metrics.RETIRED_NAME]
+
+
+def test_recycled_pid_does_not_take_over_a_dead_snapshot(metrics_dir):
+    # Our own pid, but a start time that isn't ours: an earlier process with the same pid
+    write_snapshot(metrics_dir, f"{os.getpid()}-1", 2)
+    assert counter("bytequest_test_total") == 2
+    # Its gauges went with it
+    assert counter("bytequest_db_pool_checked_out") == 0
+    assert not (metrics_dir / f"{os.getpid()}-1.json").exists()
+    assert counter("bytequest_test_total") == 2
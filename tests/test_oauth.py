@@ -0,0 +1,80 @@
+"""Google and Microsoft sign-in end to end, against tests/fake_idp.py."""
+from urllib.parse import urlparse
+
+import pytest
+import requests
+
+import oauth_providers
+from fake_idp import GOOGLE_PROFILE, MICROSOFT_PROFILE, FakeIdentityProvider
+from user import User
+
+
+@pytest.fixture
+def idp(monkeypatch):
+    idp = FakeIdentityProvider().start()
+    monkeypatch.setenv("REQUESTS_CA_BUNDLE", idp.cert_path)
+    monkeypatch.setattr(oauth_providers, "GOOGLE_CLIENT_ID", "fake-google-client")
+    monkeypatch.setattr(oauth_providers, "GOOGLE_CLIENT_SECRET", "fake-google-secret")
+    monkeypatch.setattr(oauth_providers, "MICROSOFT_CLIENT_ID", "fake-microsoft-client")
+    monkeypatch.setattr(oauth_providers, "MICROSOFT_CLIENT_SECRET", "fake-microsoft-secret")
+    monkeypatch.setattr(oauth_providers, "MICROSOFT_AUTHORITY_URL", idp.microsoft_authority_url)
+    monkeypatch.setattr(oauth_providers, "MICROSOFT_GRAPH_ME_URL", idp.microsoft_graph_me_url)
+    monkeypatch.setattr(oauth_providers, "MICROSOFT_VALIDATE_AUTHORITY", False)
+    monkeypatch.setattr(oauth_providers, "_msal_app", None)
+    monkeypatch.setattr(
+        oauth_providers, "google_discovery", oauth_providers.DiscoveryCache("google", idp.google_discovery_url)
+    )
+    monkeypatch.setattr(oauth_providers, "BREAKERS", {
+        "google": oauth_providers.CircuitBreaker("google"),
+        "microsoft": oauth_providers.CircuitBreaker("microsoft"),
+    })
+    yield idp
+    idp.stop()
+
+
+def sign_in(client, idp, login_path):
+    """Start a login, let the fake provider approve it and return the callback response."""
+    response = client.get(login_path)
+    assert response.status_code == 302
+    approved = requests.get(response.headers["Location"], allow_redirects=False, verify=idp.cert_path)
+    assert approved.status_code == 302
+    callback = urlparse(approved.headers["Location"])
+    return client.get(f"{callback.path}?{callback.query}")
+
+
+def test_google_login_creates_user_and_caches_discovery(app, idp):
+    client = app.test_client()
+    response = sign_in(client, idp, "/logingoogle")
+
+    assert response.status_code == 302
+    assert urlparse(response.headers["Location"]).path == "/"
+    assert client.get("/home").status_code == 200
+    with app.app_context():
+        user = User.get_by_email(GOOGLE_PROFILE["email"])
+    assert user.id == GOOGLE_PROFILE["sub"]
+    assert user.name == GOOGLE_PROFILE["given_name"]
+
+    # A second login reuses the account and the cached discovery document
+    assert sign_in(app.test_client(), idp, "/logingoogle").status_code == 302
+    assert idp.requests.count(("GET", "/google/.well-known/openid-configuration")) == 1
+    assert idp.requests.count(("POST", "/token")) == 2
+
+
+def test_microsoft_login_creates_user(app, idp):
+    client = app.test_client()
+    response = sign_in(client, idp, "/loginmicrosoft")
+
+    assert response.status_code == 302
+    assert client.get("/home").status_code == 200
+    with app.app_context():
+        user = User.get_by_email(MICROSOFT_PROFILE["mail"])
+    assert user.id == "microsoft_" + MICROSOFT_PROFILE["id"]
+    assert ("GET", "/common/v2.0/.well-known/openid-configuration") in idp.requests
+    assert ("GET", "/graph/me") in idp.requests
+
+
+def test_unreachable_provider_is_a_503(app, idp):
+    idp.stop()
+    response = app.test_client().get("/logingoogle")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
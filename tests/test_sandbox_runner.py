@@ -0,0 +1,75 @@
+"""Grading several test cases in one sandbox run."""
+import signal
+
+import codeEvaluator
+from sandbox_runner import CASE_TIMEOUT_ERROR, evaluate
+
+SCALED = "submit_answers(x, x * 2, x * 3)\n"
+
+
+def unit_key(xs, wrong=(), stop_on_first_failure=True):
+    return {
+        "cases": [
+            {"inputs": {"x": x}, "answers": [x, x * 2, x * 3 + (1 if x in wrong else 0)]}
+            for x in xs
+        ],
+        "points": 10,
+        "stop_on_first_failure": stop_on_first_failure,
+        "case_cpu_seconds": 0.2,
+    }
+
+
+def outcomes(result):
+    return [(case["case"], case["passed"], case["error"]) for case in result["cases"]]
+
+
+def test_every_case_is_reported_when_they_all_pass():
+    result = evaluate("unit", SCALED, unit_key([1, 2, 3]))
+    assert result["success"] and result["score"] == 10
+    assert outcomes(result) == [(1, True, None), (2, True, None), (3, True, None)]
+    assert result["cases"][2]["got"] == [3, 6, 9]
+
+
+def test_stops_at_the_first_failure_unless_told_not_to():
+    result = evaluate("unit", SCALED, unit_key([1, 2, 3], wrong={2}))
+    assert not result["success"]
+    assert outcomes(result) == [(1, True, None), (2, False, None)]
+    assert result["message"] == "Passed 1 of 3 test cases; case 2 gave incorrect answers"
+
+    result = evaluate("unit", SCALED, unit_key([1, 2, 3], wrong={2}, stop_on_first_failure=False))
+    assert outcomes(result) == [(1, True, None), (2, False, None), (3, True, None)]
+    assert result["message"] == "Passed 2 of 3 test cases; case 2 gave incorrect answers"
+
+
+def test_a_case_out_of_cpu_budget_times_out_and_later_cases_still_run():
+    previous_handler = signal.getsignal(signal.SIGPROF)
+    code = "if x == 1:\n    while True:\n        pass\n" + SCALED
+    result = evaluate("unit", code, unit_key([1, 2, 3], stop_on_first_failure=False))
+    assert outcomes(result) == [(1, False, CASE_TIMEOUT_ERROR), (2, True, None), (3, True, None)]
+    assert "limit_exceeded" not in result
+    # Nothing left armed to fire once grading is over
+    assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0)
+    assert signal.getsignal(signal.SIGPROF) is previous_handler
+
+
+def test_code_that_swallows_the_timeout_is_still_stopped():
+    code = (
+        "if x == 1:\n"
+        "    while True:\n"
+        "        try:\n"
+        "            while True:\n"
+        "                pass\n"
+        "        except:\n"
+        "            pass\n"
+        + SCALED
+    )
+    result = evaluate("unit", code, unit_key([1, 2], stop_on_first_failure=False))
+    assert outcomes(result) == [(1, False, CASE_TIMEOUT_ERROR), (2, True, None)]
+
+
+def test_case_timeouts_are_not_cached():
+    single = {"error": CASE_TIMEOUT_ERROR}
+    several = {"success": False, "cases": [{"error": None}, {"error": CASE_TIMEOUT_ERROR}]}
+    assert not codeEvaluator.is_cacheable(single)
+    assert not codeEvaluator.is_cacheable(several)
+    assert codeEvaluator.is_cacheable({"success": True, "cases": [{"error": None}]})
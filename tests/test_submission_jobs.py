@@ -0,0 +1,25 @@
+"""Per-user in-flight submission slots."""
+import os
+
+import node_sync
+import submission_jobs
+
+
+def test_user_slots_use_a_fixed_set_of_lock_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(node_sync, "RUN_DIR", str(tmp_path))
+    monkeypatch.setattr(submission_jobs, "MAX_INFLIGHT_PER_USER", 1)
+    monkeypatch.setattr(submission_jobs, "INFLIGHT_BUCKETS", 8)
+    for user_id in range(200):
+        release = submission_jobs.claim_user_slot(user_id)
+        assert release is not None
+        release()
+    assert len(os.listdir(tmp_path / "inflight")) <= 8
+
+
+def test_a_second_submission_from_the_same_user_is_refused(tmp_path, monkeypatch):
+    monkeypatch.setattr(node_sync, "RUN_DIR", str(tmp_path))
+    monkeypatch.setattr(submission_jobs, "MAX_INFLIGHT_PER_USER", 1)
+    release = submission_jobs.claim_user_slot(42)
+    assert submission_jobs.claim_user_slot(42) is None
+    release()
+    submission_jobs.claim_user_slot(42)()
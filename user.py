@@ -1,20 +1,69 @@
-from flask_login import UserMixin
+import os
+import threading
+import time
+from collections import OrderedDict
 
+import metrics
+import node_sync
 from db import get_db
 
-class User(UserMixin):
+# Users loaded for authenticated requests are cached per worker for a short
+# time. create()/update_profile() bump the user's slot in a node-wide
+# generation table, so an edit in any worker invalidates every copy.
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_GENERATIONS = node_sync.GenerationTable("user.gen")
+
+SELECT_USER_BY_ID = "SELECT id, name, email, profile_pic FROM \"user\" WHERE id = :id"
+SELECT_USER_BY_EMAIL = "SELECT id, name, email, profile_pic FROM \"user\" WHERE email = :email"
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"loads": 0, "hits": 0, "misses": 0}
+
+class User:
+    """A logged-in user. Implements the interface Flask-Login expects
+    (same as flask_login.UserMixin) with __slots__ so cached instances stay small."""
+
+    __slots__ = ("id", "name", "email", "profile_pic")
+    __hash__ = object.__hash__
+
     def __init__(self, id_, name, email, profile_pic):
         self.id = id_
         self.name = name
         self.email = email
         self.profile_pic = profile_pic
 
+    @property
+    def is_active(self):
+        return True
+
+    @property
+    def is_authenticated(self):
+        return self.is_active
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return NotImplemented
+        return not equal
+
     @staticmethod
     def get(user_id):
         db = get_db()
-        user = db.execute(
-            "SELECT * FROM user WHERE id = ?", (user_id,)
-        ).fetchone()
+        user = db.execute(SELECT_USER_BY_ID, {"id": user_id}).fetchone()
         if not user:
             return None
 
@@ -23,22 +72,62 @@ class User(UserMixin):
         )
         return user
 
+    @staticmethod
+    def load(user_id):
+        """User.get through the per-worker TTL/LRU cache; used by the login manager."""
+        generation = USER_GENERATIONS.current(user_id)
+        now = time.monotonic()
+        with _cache_lock:
+            _cache_stats["loads"] += 1
+            cached = _cache.get(user_id)
+            if cached is not None:
+                expires, cached_generation, user = cached
+                if expires > now and generation is not None and cached_generation == generation:
+                    _cache.move_to_end(user_id)
+                    _cache_stats["hits"] += 1
+                    return user
+                del _cache[user_id]
+            _cache_stats["misses"] += 1
+
+        user = User.get(user_id)
+        if user is not None and generation is not None and USER_CACHE_SIZE > 0:
+            with _cache_lock:
+                _cache[user_id] = (now + USER_CACHE_TTL_SECONDS, generation, user)
+                while len(_cache) > USER_CACHE_SIZE:
+                    _cache.popitem(last=False)
+        return user
+
+    @staticmethod
+    def cache_stats():
+        """Loader cache counters; "saved_per_request" is DB round-trips avoided per load
+        (exported on /metrics as bytequest_user_cache_*_total)."""
+        with _cache_lock:
+            stats = dict(_cache_stats)
+            stats["entries"] = len(_cache)
+        stats["saved_per_request"] = stats["hits"] / stats["loads"] if stats["loads"] else 0.0
+        return stats
+
+    @staticmethod
+    def invalidate(user_id):
+        with _cache_lock:
+            _cache.pop(user_id, None)
+        USER_GENERATIONS.bump(user_id)
+
     @staticmethod
     def create(id_, name, email, profile_pic):
         db = get_db()
         db.execute(
-            "INSERT INTO user (id, name, email, profile_pic) "
-            "VALUES (?, ?, ?, ?)",
-            (id_, name, email, profile_pic),
+            'INSERT INTO "user" (id, name, email, profile_pic) '
+            "VALUES (:id, :name, :email, :profile_pic)",
+            {"id": id_, "name": name, "email": email, "profile_pic": profile_pic},
         )
         db.commit()
+        User.invalidate(id_)
 
     @staticmethod
     def get_by_email(email):
         db = get_db()
-        user = db.execute(
-            "SELECT * FROM user WHERE email = ?", (email,)
-        ).fetchone()
+        user = db.execute(SELECT_USER_BY_EMAIL, {"email": email}).fetchone()
         if not user:
             return None
         return User(id_=user[0], name=user[1], email=user[2], profile_pic=user[3])
@@ -47,7 +136,18 @@ class User(UserMixin):
     def update_profile(id_, name, profile_pic):
         db = get_db()
         db.execute(
-            "UPDATE user SET name = ?, profile_pic = ? WHERE id = ?",
-            (name, profile_pic, id_),
+            'UPDATE "user" SET name = :name, profile_pic = :profile_pic WHERE id = :id',
+            {"id": id_, "name": name, "profile_pic": profile_pic},
         )
-        db.commit()
\ No newline at end of file
+        db.commit()
+        User.invalidate(id_)
+
+def user_cache_metrics():
+    # Every hit is a user query the login loader didn't have to run
+    stats = User.cache_stats()
+    return [
+        (f"bytequest_user_cache_{name}_total", {}, stats[name])
+        for name in ("loads", "hits", "misses")
+    ]
+
+metrics.register_collector(user_cache_metrics)
@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+
+class LessonReadBuffer:
+    """Per-process buffer of (user_id, unit, slug, read_at) lesson-read events.
+
+    Events are coalesced (a lesson read twice is stored once) and handed to a
+    flush callback in one batch when the buffer reaches flush_size, when the
+    oldest event is flush_seconds old, or when the process exits.
+    """
+
+    def __init__(self, flush_size, flush_seconds):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._events = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+
+    def add(self, user_id, unit, slug):
+        """Buffer an event. Returns True once the buffer is due for a flush."""
+        with self._lock:
+            self._events.setdefault((user_id, unit, slug), time.time())
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            return len(self._events) >= self.flush_size
+
+    def pending_for(self, user_id):
+        """Buffered slugs for one user as {unit: set(slugs)}."""
+        pending = {}
+        with self._lock:
+            for (event_user, unit, slug) in self._events:
+                if event_user == user_id:
+                    pending.setdefault(unit, set()).add(slug)
+        return pending
+
+    def drain(self):
+        """Remove and return all buffered events as a list of tuples."""
+        with self._lock:
+            events = [key + (read_at,) for key, read_at in self._events.items()]
+            self._events = {}
+            self._oldest = None
+        return events
+
+    def restore(self, events):
+        """Put back events whose flush failed so they are retried later."""
+        with self._lock:
+            for user_id, unit, slug, read_at in events:
+                self._events.setdefault((user_id, unit, slug), read_at)
+            if self._events and self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def due(self):
+        with self._lock:
+            return self._oldest is not None and (
+                time.monotonic() - self._oldest >= self.flush_seconds
+                or len(self._events) >= self.flush_size
+            )
+
+    def start_flusher(self, flush):
+        """Run flush() from a daemon thread whenever the buffer is due.
+
+        Safe to call on every add(): it starts one thread per process.
+        """
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+        def loop():
+            while True:
+                time.sleep(max(self.flush_seconds / 4, 0.05))
+                if self.due():
+                    flush()
+
+        threading.Thread(target=loop, name="lesson-read-flusher", daemon=True).start()